@@ -12,19 +12,22 @@ import copy
 import re
 import os, sys
 import time, datetime
-import urllib, httplib
+import urllib
+import threading, Queue
 from xml.sax import saxutils
 
 # Data fetch lib
 import digestfetch
+from digestcache import http_cache, image_cache
+from digestrecord import Session
 
 # 3rd party modules
 from reportlab.lib.pagesizes import A4, landscape
 from reportlab.lib.units import inch
 from reportlab.lib.colors import HexColor
 from reportlab.platypus import Paragraph, Spacer, Image, Table, TableStyle
-
-import pylast
+from reportlab.lib.utils import setURLCache
+from reportlab import rl_config
 
 from django.dateformat import DateFormat
 
@@ -40,6 +43,15 @@ SPREAD = '0-0'
 
 FRAME_PADDING = 10
 
+# Resolution images are resampled to before embedding
+IMAGE_DPI = 300
+
+# Embed image data as binary, so JPEGs go in untouched
+rl_config.useA85 = 0
+
+# Fit each frame's content up front rather than letting addFromList drop the overflow
+PACK_FRAMES = True
+
 MARGINS = {
     'top': 0,
     'right': 0,
@@ -53,6 +65,17 @@ TR = (1, 0)
 BR = (1, -1)
 BL = (0, -1)
 
+# Seconds to wait for each source before giving up on it
+FETCH_TIMEOUTS = {
+    'events':       60,
+    'flickr':       90,
+    'weather':      30,
+    'gcal':         60,
+    'tube':         30,
+    'twitter':      30,
+    'newsgator':    30,
+}
+
 FILENAME = os.path.join(PROJECT_PATH, "output/digest.pdf")
 print FILENAME
 
@@ -176,44 +199,37 @@ def get_stylesheet():
 
     return stylesheet
 
-def format_event_recommendations(style):
+def format_event_recommendations(events, style):
     """Format event recommendations fetched from Last.fm into reportlab Flowables"""
     
-    events = digestfetch.lastfm_event_recommendations()
-    
     paragraphs = []
     latlongs = []
     i = 1
     for e in events:
-        try:
-            print u'• %s (%s)' % (e.getTitle(), e.getID())
-            startDate = e.getStartDate()
-            df = DateFormat(startDate)
-            image = e.getImage(pylast.IMAGE_SMALL)
-            image_html = ""
-            if image:
-                image_html = u"""
+        print u'• %s (%s)' % (e['title'], e['id'])
+        df = DateFormat(e['start_date'])
+        image_html = ""
+        if e['image']:
+            image_html = u"""
 <img src="%(image)s" width="%(dimension)s" height="%(dimension)s" valign="top"/>""" % {
-                    'image': e.getImage(pylast.IMAGE_SMALL),
-                    'dimension': inch / 4,
-                }
-            text = u"""%(image_html)s
+                'image': e['image'],
+                'dimension': inch / 4,
+            }
+        text = u"""%(image_html)s
 <seq id="eventrec">. <b>%(title)s</b> %(time)s - %(venue)s %(postcode)s
 <br/>
 %(artists)s
 """ % {
-                'image_html': image_html,
-                'title': e.getTitle(),
-                'artists': u", ".join(e._getFromInfo('artists')),
-                'venue': e.getVenueName(),
-                'postcode': e.getPostalCode() or u"",
-                'time': df.format('D P'),
-            }
-            latlongs.append((i, "%s,%s" % e.getGeoPoint()))
-            i += 1
-            paragraphs.append(Paragraph(text, style["Event"]))
-        except (pylast.ServiceException, httplib.BadStatusLine), exc:
-            print u'! FAILED - %s (%s)' % (exc, e.getID())
+            'image_html': image_html,
+            'title': e['title'],
+            'artists': u", ".join(e['artists']),
+            'venue': e['venue'],
+            'postcode': e['postcode'] or u"",
+            'time': df.format('D P'),
+        }
+        latlongs.append((i, "%s,%s" % e['geo_point']))
+        i += 1
+        paragraphs.append(Paragraph(text, style["Event"]))
     return paragraphs, latlongs
 
 def generate_map_url(latlongs, width, height):
@@ -232,10 +248,10 @@ def generate_map_url(latlongs, width, height):
     print event_map_url
     return event_map_url
 
-def format_tube_status(style, available_width):
+def format_tube_status(data, style, available_width):
     """Format Tube status fetched from TFL into reportlab Flowables"""
     
-    line_status, station_status = digestfetch.tube_status()
+    line_status, station_status = data
     
     print "Processing",
     colors = digestfetch.get_tube_colors()
@@ -274,17 +290,18 @@ def format_tube_status(style, available_width):
     flowables.append(Spacer(available_width, 8))
     
     for category, stations in station_status.iteritems():
-        flowables.append(Paragraph(category, style["Body"]))
+        # A section, so packing keeps the heading with its stations
+        section = [Paragraph(category, style["Body"])]
         for station in stations:
             print ".",
-            flowables.append(Paragraph(u"<bullet>•</bullet> %s" % station.strip(), style["List"]))
+            section.append(Paragraph(u"<bullet>•</bullet> %s" % station.strip(), style["List"]))
+        flowables.append(section)
     print "done"
     return flowables
 
-def format_twitter_statuses(style):
+def format_twitter_statuses(statuses, style):
     """Format Twitter statuses into reportlab Flowables"""
     paragraphs = []
-    statuses = digestfetch.twitter_friends()
     if statuses:
         for status in statuses:
             updateDate = datetime.datetime.strptime(status['created_at'], '%a %b %d %H:%M:%S +0000 %Y')
@@ -314,9 +331,8 @@ def format_twitter_statuses(style):
             
     return paragraphs
 
-def format_newsgator_headlines(style):
+def format_newsgator_headlines(data, style):
     """Format RSS feeds from Newsgator into reportlab Flowables"""
-    data = digestfetch.newsgator_headlines()
     
     print "Processing",
     flowables = []
@@ -333,9 +349,8 @@ def format_newsgator_headlines(style):
     print "done"
     return flowables
 
-def format_gcal_events(style, available_width):
+def format_gcal_events(events, style, available_width):
     """Form events from Google Calendar into reportlab Flowables"""
-    events = digestfetch.gcal_events()
     
     print "Processing",
     flowables = []
@@ -396,15 +411,17 @@ def format_gcal_events(style, available_width):
         ('BOTTOMPADDING',   TL, BR, 1),
         ('LEFTPADDING',     TL, BR, 2),
     ])
-    fifth_width = available_width / 5
-    table = Table(table_data, colWidths=(1.2*fifth_width, 3.8*fifth_width), style=line_styles)
-    table.setStyle(TableStyle(table_styles))
-    flowables.append(table)
+    # Every calendar can fail, e.g. when none are cached for a dry run
+    if table_data:
+        fifth_width = available_width / 5
+        table = Table(table_data, colWidths=(1.2*fifth_width, 3.8*fifth_width), style=line_styles)
+        table.setStyle(TableStyle(table_styles))
+        flowables.append(table)
     print "done"
     return flowables
 
-def format_weather(style, available_width):
-    forecast_data, warning_data = digestfetch.weather()
+def format_weather(data, style, available_width):
+    forecast_data, warning_data = data
     
     # http://www.bbc.co.uk/weather/images/symbols/57x57/3.gif
     # http://www.bbc.co.uk/weather/images/symbols/fiveday_sym/3.gif (80/65)
@@ -475,8 +492,8 @@ def format_weather(style, available_width):
     print "done"
     return weather_flowables
 
-def format_flickr_photo(style, width, height):
-    photo, size = digestfetch.contact_photo()
+def format_flickr_photo(data, style, width, height):
+    photo, size = data
     datetaken = datetime.datetime.strptime(photo.attrib['datetaken'], "%Y-%m-%d %H:%M:%S")
     df = DateFormat(datetaken)
     datestring = df.format('l F jS P')
@@ -507,54 +524,133 @@ def format_flickr_photo(style, width, height):
         )
     ]
 
+def fetch_sources(sources, timeouts=FETCH_TIMEOUTS):
+    """Start every source fetch at once and yield (name, data) as each one arrives
+    
+    Each source runs in its own daemon thread. A source that raises or doesn't
+    finish within its timeout is reported and yielded with data of None.
+    """
+    results = Queue.Queue()
+    
+    def run(name, fetch):
+        try:
+            results.put((name, fetch(), None))
+        except Exception, e:
+            results.put((name, None, e))
+    
+    started = time.time()
+    deadlines = {}
+    for name, fetch in sources.items():
+        deadlines[name] = started + timeouts.get(name, 60)
+        thread = threading.Thread(target=run, args=(name, fetch), name=name)
+        thread.setDaemon(True)
+        thread.start()
+    
+    while deadlines:
+        wait = max(min(deadlines.values()) - time.time(), 0)
+        try:
+            name, data, error = results.get(timeout=wait)
+        except Queue.Empty:
+            # Give up on everything that's overdue
+            now = time.time()
+            for name, deadline in deadlines.items():
+                if deadline <= now:
+                    del deadlines[name]
+                    print u"! %s timed out after %ss" % (name, timeouts.get(name, 60))
+                    yield name, None
+            continue
+        if name not in deadlines:
+            # Arrived after we'd given up on it
+            continue
+        del deadlines[name]
+        if error:
+            print u"! %s failed: %s" % (name, error)
+        else:
+            print u"%s fetched in %.2fs" % (name, time.time() - started)
+        yield name, data
+
 def fetch_frame_content(style, frame_width, frame_height):
     """Fetch content to stuff in our frames"""
     
     available_width = frame_width - FRAME_PADDING*2
     available_height = frame_height - FRAME_PADDING*2
     
-    print "Fetching event recs"
-    event_flowables, latlongs = format_event_recommendations(style)
-    
     map_width = int(available_width)
     map_height = int(available_height / 3)
     
-    event_map_url = generate_map_url(latlongs, map_width*2, map_height*2)
-    
-    if event_map_url:
-        event_flowables.insert(0, Spacer(map_width, map_height))
-        event_flowables.insert(0, Paragraph(
-            u'<img src=%s valign="top" width="%s" height="%s"/>' % (
-                saxutils.quoteattr(event_map_url),
-                map_width,
-                map_height,
-            ), style["Body"])
-        )
-    print "==================="
-    
-    print "Fetching Flickr photo"
-    flickr_flowable = format_flickr_photo(style, frame_width*2, frame_height)
-    print "==================="
-    
-    print "Fetching weather forecast"
-    weather_flowables = format_weather(style, available_width)
-    print "==================="
-    
-    print "Fetching Google Calendar events"
-    gcal_flowables = format_gcal_events(style, available_width)
-    print "==================="
-    
-    print "Fetching tube status"
-    tube_flowables = format_tube_status(style, available_width)
-    print "==================="
-    
-    print "Fetching Twitter updates"
-    twitter_flowables = format_twitter_statuses(style)
-    print "==================="
+    def format_events(events):
+        event_flowables, latlongs = format_event_recommendations(events, style)
+        
+        event_map_url = generate_map_url(latlongs, map_width*2, map_height*2)
+        
+        if event_map_url:
+            event_flowables.insert(0, Spacer(map_width, map_height))
+            event_flowables.insert(0, Paragraph(
+                u'<img src=%s valign="top" width="%s" height="%s"/>' % (
+                    saxutils.quoteattr(event_map_url),
+                    map_width,
+                    map_height,
+                ), style["Body"])
+            )
+        return event_flowables
+    
+    # name: (description, fetch, format)
+    sources = {
+        'events': (
+            "event recs",
+            digestfetch.lastfm_event_recommendations,
+            format_events,
+        ),
+        'flickr': (
+            "Flickr photo",
+            digestfetch.contact_photo,
+            lambda data: format_flickr_photo(data, style, frame_width*2, frame_height),
+        ),
+        'weather': (
+            "weather forecast",
+            digestfetch.weather,
+            lambda data: format_weather(data, style, available_width),
+        ),
+        'gcal': (
+            "Google Calendar events",
+            digestfetch.gcal_events,
+            lambda data: format_gcal_events(data, style, available_width),
+        ),
+        'tube': (
+            "tube status",
+            digestfetch.tube_status,
+            lambda data: format_tube_status(data, style, available_width),
+        ),
+        'twitter': (
+            "Twitter updates",
+            digestfetch.twitter_friends,
+            lambda data: format_twitter_statuses(data, style),
+        ),
+        'newsgator': (
+            "Newsgator headlines",
+            digestfetch.newsgator_headlines,
+            lambda data: format_newsgator_headlines(data, style),
+        ),
+    }
     
-    print "Fetching Newsgator headlines"
-    newsgator_flowables = format_newsgator_headlines(style)
-    print "==================="
+    print "Fetching %s" % ", ".join([description for description, fetch, format in sources.values()])
+    flowables = dict([(name, []) for name in sources])
+    for name, data in fetch_sources(dict([(name, fetch) for name, (description, fetch, format) in sources.items()])):
+        description, fetch, format = sources[name]
+        if data is None:
+            print "! No %s" % description
+        else:
+            print "Formatting %s" % description
+            flowables[name] = format(data)
+        print "==================="
+    
+    event_flowables = flowables['events']
+    flickr_flowable = flowables['flickr']
+    weather_flowables = flowables['weather']
+    gcal_flowables = flowables['gcal']
+    tube_flowables = flowables['tube']
+    twitter_flowables = flowables['twitter']
+    newsgator_flowables = flowables['newsgator']
     
     content = {
         '1-0': {
@@ -600,6 +696,141 @@ def fetch_frame_content(style, frame_width, frame_height):
     }
     return content
 
+def collect_image_urls(flowables):
+    """Find the remote <img> sources used by a list of flowables"""
+    urls = []
+    for f in flowables:
+        if isinstance(f, (list, tuple)):
+            urls.extend(collect_image_urls(f))
+        elif isinstance(f, Table):
+            for row in f._cellvalues:
+                urls.extend(collect_image_urls(row))
+        elif isinstance(f, Paragraph):
+            for frag in f.frags:
+                defn = getattr(frag, 'cbDefn', None)
+                if getattr(defn, 'kind', None) == 'img' and defn.src.startswith('http'):
+                    urls.append(defn.src)
+    return urls
+
+def prefetch_images(content):
+    """Download every image the frames will need ahead of rendering"""
+    urls = collect_image_urls([frame_info['content'] for frame_info in content.values()])
+    print "Prefetching %d images" % len(urls)
+    started = time.time()
+    image_cache.prefetch(urls)
+    print "done in %.2fs" % (time.time() - started)
+
+def flatten_sections(flowables):
+    """Return a frame's content as a plain list, with its sections spliced in"""
+    flat = []
+    for f in flowables:
+        if isinstance(f, (list, tuple)):
+            flat.extend(f)
+        else:
+            flat.append(f)
+    return flat
+
+def pack_frame(frame, flowables, canvas):
+    """Choose the flowables that will fit in a frame, measuring them with wrap only
+    
+    Flowables are taken in order while they fit, spaced out the same way
+    Frame.add does it. One that's too tall is split to fill the rest of the
+    frame if it can be, and that ends the frame. Otherwise it's left out so
+    that later, shorter ones get a chance.
+    
+    A list among the flowables is a section, like a heading and its items.
+    Once one of its items is left out so is the rest of the section, and the
+    heading too if nothing else of the section made it. Returns the
+    flowables to draw and the ones that didn't make it.
+    """
+    packed = []
+    dropped = []
+    width = frame._getAvailableWidth()
+    bottom = frame._y1p
+    y = frame._y
+    at_top = frame._atTop
+    prev_space = frame._prevASpace
+    sections = [isinstance(f, (list, tuple)) and list(f) or [f] for f in flowables]
+    while sections:
+        section = sections.pop(0)
+        # Where the section starts, in case its heading has to come back out
+        start = len(packed), len(dropped), y, at_top, prev_space
+        heading_only = len(section) > 1
+        while section:
+            flowable = section.pop(0)
+            if getattr(flowable, 'frameAction', None):
+                packed.append(flowable)
+                continue
+            space = 0
+            if not at_top:
+                space = flowable.getSpaceBefore()
+                if frame._oASpace:
+                    space = max(space - prev_space, 0)
+            available = y - bottom - space
+            fits = False
+            if available > 0:
+                flowable.canv = canvas
+                try:
+                    w, h = flowable.wrap(width, available)
+                    fits = y - space - h >= bottom - rl_config._FUZZ
+                    if not fits:
+                        # Too tall, so see if the start of it would do
+                        parts = flowable.split(frame._aW, available)
+                        if parts:
+                            parts[0].canv = canvas
+                            try:
+                                w, h = parts[0].wrap(width, available)
+                            finally:
+                                del parts[0].canv
+                            if y - space - h >= bottom - rl_config._FUZZ:
+                                packed.append(parts[0])
+                                dropped.extend(parts[1:] + section + flatten_sections(sections))
+                                return packed, dropped
+                finally:
+                    del flowable.canv
+            if not fits:
+                dropped.append(flowable)
+                dropped.extend(section)
+                if heading_only and len(packed) == start[0] + 1:
+                    dropped.insert(start[1], packed.pop())
+                    y, at_top, prev_space = start[2:]
+                break
+            packed.append(flowable)
+            new_y = y - space - h - flowable.getSpaceAfter()
+            if frame._oASpace:
+                prev_space = flowable.getSpaceAfter()
+            if new_y != y:
+                at_top = False
+            y = new_y
+    return packed, dropped
+
+def measure_frame(frame, flowables, canvas):
+    """Return the height a frame's flowables would take up if the frame had no bottom"""
+    width = frame._getAvailableWidth()
+    height = 0
+    at_top = frame._atTop
+    prev_space = frame._prevASpace
+    for flowable in flatten_sections(flowables):
+        if getattr(flowable, 'frameAction', None):
+            continue
+        space = 0
+        if not at_top:
+            space = flowable.getSpaceBefore()
+            if frame._oASpace:
+                space = max(space - prev_space, 0)
+        flowable.canv = canvas
+        try:
+            w, h = flowable.wrap(width, frame._aH)
+        finally:
+            del flowable.canv
+        after = flowable.getSpaceAfter()
+        if frame._oASpace:
+            prev_space = after
+        if space + h + after:
+            at_top = False
+        height += space + h + after
+    return height
+
 def draw_frames(canvas, frames, content, row_translation):
     """Fill our frames with content"""
     for f in frames:
@@ -618,7 +849,14 @@ def draw_frames(canvas, frames, content, row_translation):
                 canvas.rotate(row_translation['rotation'])
             # Render the content
             print u"Rendering frame %s (page: %s)" % (f.id, frame_info['page'])
-            f.addFromList(frame_info['content'], canvas)
+            flowables = frame_info['content']
+            if PACK_FRAMES:
+                flowables, dropped = pack_frame(f, flowables, canvas)
+                if dropped:
+                    print u"! %d didn't fit" % len(dropped)
+            else:
+                flowables = flatten_sections(flowables)
+            f.addFromList(flowables, canvas)
             canvas.restoreState()
 
 def main():
@@ -639,7 +877,7 @@ def main():
         'translate_y': HEIGHT + MARGINS['top'] - MARGINS['bottom'] + frame_height,
     }
     
-    digest_canvas = canvas.Canvas(FILENAME, pagesize=PAGE_SIZE, bottomup=1, verbosity=1)
+    digest_canvas = canvas.Canvas(FILENAME, pagesize=PAGE_SIZE, bottomup=1, verbosity=1, imageDPI=IMAGE_DPI)
     
     # x_list = [(x * frame_width) + MARGINS['left'] for x in range(0, X_FRAMES + 1)]
     # y_list = [(y * frame_height) + MARGINS['top'] for y in range(0, Y_FRAMES + 1)]
@@ -652,9 +890,15 @@ def main():
     
     stylesheet = get_stylesheet()
     
+    # Serve remote images from the local cache
+    setURLCache(image_cache)
+    
     content = fetch_frame_content(stylesheet, frame_width, frame_height)
     
+    prefetch_images(content)
+    
     draw_frames(digest_canvas, frames, content, row_translations)
+    image_cache.save()
     
     # Save and close
     digest_canvas.showPage()
@@ -664,5 +908,68 @@ def main():
     from subprocess import call
     call(["open", FILENAME])
 
+def dry_run():
+    """Lay out the booklet from cached data without fetching images or writing a PDF
+    
+    Each frame's content is wrapped on a canvas that's never saved, then how
+    full the frame would be and how long that took are printed. Images are
+    sized from their <img> width and height, so no pixels are fetched.
+    """
+    from reportlab.pdfgen import canvas
+    
+    # Serve whatever's cached, however old
+    http_cache.offline = True
+    
+    frame_width, frame_height = calculate_frame_dimensions()
+    frames = setup_frames(frame_width, frame_height)
+    stylesheet = get_stylesheet()
+    null_canvas = canvas.Canvas(os.devnull, pagesize=PAGE_SIZE)
+    
+    started = time.time()
+    content = fetch_frame_content(stylesheet, frame_width, frame_height)
+    print "Content ready in %.2fs" % (time.time() - started)
+    
+    for f in frames:
+        frame_info = content.get(f.id)
+        if frame_info:
+            started = time.time()
+            needed = measure_frame(f, frame_info['content'], null_canvas)
+            packed, dropped = pack_frame(f, frame_info['content'], null_canvas)
+            print u"Frame %s (page: %s): %d%% full, %d flowables fit, %d don't, %.3fs" % (
+                f.id,
+                frame_info['page'],
+                round(100 * needed / f._aH),
+                len(packed),
+                len(dropped),
+                time.time() - started,
+            )
+
 if __name__ == '__main__':
-    main()
+    from optparse import OptionParser
+    
+    parser = OptionParser()
+    parser.add_option("--dry-run", action="store_true",
+        help="lay out the frames and report how full they are without writing a PDF")
+    parser.add_option("--record", metavar="FILE",
+        help="save every response the sources get to FILE")
+    parser.add_option("--replay", metavar="FILE",
+        help="answer every request from responses saved with --record, without the network")
+    options, args = parser.parse_args()
+    
+    session = None
+    if options.record or options.replay:
+        # Every request has to reach the network layer to be recorded or replayed
+        http_cache.enabled = False
+        if options.record:
+            session = Session(options.record, 'record')
+        else:
+            session = Session(options.replay, 'replay')
+        session.start()
+    try:
+        if options.dry_run:
+            dry_run()
+        else:
+            main()
+    finally:
+        if session:
+            session.stop()
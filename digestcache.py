@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+digestcache.py
+On-disk caches for source responses and remote images
+"""
+
+import sitecustomize
+
+# Builtin modules
+import os
+import time
+import threading, Queue
+import urllib2
+import cPickle as pickle
+from hashlib import md5, sha1
+
+# Settings, keys, passwords
+from settings import PROJECT_PATH
+
+CACHE_PATH = os.path.join(PROJECT_PATH, "cache")
+
+class ResponseCache(object):
+    """Size bounded LRU cache of response bodies with their validators
+
+    Each entry is a single pickled file named after a hash of its key, holding
+    the body along with the ETag and Last-Modified headers it was served with.
+    A file's mtime records when the entry was last used, so the least recently
+    used entries are the first to go once the cache outgrows max_size bytes.
+    When offline, entries are served however old they are and anything that
+    isn't cached raises URLError rather than going to the network. When not
+    enabled, nothing is read or stored and every fetch goes to the network.
+    """
+
+    def __init__(self, path, max_size=20*1024*1024, offline=False, enabled=True):
+        self.path = path
+        self.max_size = max_size
+        self.offline = offline
+        self.enabled = enabled
+        self.lock = threading.RLock()
+
+    def _filename(self, key):
+        return os.path.join(self.path, md5(key).hexdigest())
+
+    def _load(self, key):
+        if not self.enabled:
+            return None
+        filename = self._filename(key)
+        try:
+            f = open(filename, 'rb')
+            try:
+                entry = pickle.load(f)
+            finally:
+                f.close()
+        except (IOError, EOFError, pickle.UnpicklingError):
+            return None
+        if entry.get('key') != key:
+            return None
+        # Mark as recently used
+        try:
+            os.utime(filename, None)
+        except OSError:
+            pass
+        return entry
+
+    def _store(self, key, entry):
+        if not self.enabled:
+            return
+        entry['key'] = key
+        self.lock.acquire()
+        try:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            filename = self._filename(key)
+            temp = "%s.%s.tmp" % (filename, threading.currentThread().getName())
+            f = open(temp, 'wb')
+            try:
+                pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+            finally:
+                f.close()
+            os.rename(temp, filename)
+            self.evict()
+        finally:
+            self.lock.release()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_size"""
+        self.lock.acquire()
+        try:
+            entries = []
+            total = 0
+            for name in os.listdir(self.path):
+                if name.endswith('.tmp'):
+                    continue
+                filename = os.path.join(self.path, name)
+                try:
+                    stat = os.stat(filename)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, filename))
+                total += stat.st_size
+            entries.sort()
+            while entries and total > self.max_size:
+                mtime, size, filename = entries.pop(0)
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+                total -= size
+        finally:
+            self.lock.release()
+
+    def check_offline(self, key):
+        """Raise URLError if key isn't cached and we're not allowed to fetch it"""
+        if self.offline and self.enabled:
+            raise urllib2.URLError("%s isn't cached" % key)
+
+    def get(self, key, ttl):
+        """Return the cached body for key if it's younger than ttl seconds"""
+        entry = self._load(key)
+        if entry and (self.offline or time.time() - entry['fetched'] < ttl):
+            return entry['body']
+
+    def set(self, key, body, etag=None, last_modified=None):
+        self._store(key, {
+            'body': body,
+            'etag': etag,
+            'last_modified': last_modified,
+            'fetched': time.time(),
+        })
+
+    def fetch(self, url, ttl, opener=None, headers=None):
+        """Fetch a URL through the cache and return the response body
+
+        Fresh entries are returned without touching the network. Stale ones
+        are revalidated with If-None-Match/If-Modified-Since and reused when
+        the server answers 304 Not Modified.
+        """
+        entry = self._load(url)
+        if entry and (self.offline or time.time() - entry['fetched'] < ttl):
+            return entry['body']
+        self.check_offline(url)
+
+        request = urllib2.Request(url, headers=headers or {})
+        if entry:
+            if entry['etag']:
+                request.add_header('If-None-Match', entry['etag'])
+            if entry['last_modified']:
+                request.add_header('If-Modified-Since', entry['last_modified'])
+        if opener is None:
+            opener = urllib2.build_opener()
+        try:
+            response = opener.open(request)
+        except urllib2.HTTPError, e:
+            if entry and e.code == 304:
+                self.set(url, entry['body'],
+                    e.headers.get('ETag', entry['etag']),
+                    e.headers.get('Last-Modified', entry['last_modified']))
+                return entry['body']
+            raise
+        try:
+            body = response.read()
+            self.set(url, body,
+                response.info().get('ETag'),
+                response.info().get('Last-Modified'))
+        finally:
+            response.close()
+        return body
+
+class FlickrCache(object):
+    """Adapts a ResponseCache to the get/set interface FlickrAPI.cache expects
+
+    Flickr API calls are POSTs, so there's nothing to revalidate and entries
+    simply expire after ttl seconds. FlickrAPI makes the call itself whenever
+    get misses, so when offline a miss raises URLError instead.
+    """
+
+    def __init__(self, cache, ttl):
+        self.cache = cache
+        self.ttl = ttl
+
+    def get(self, key, default=None):
+        body = self.cache.get("flickr:%s" % key, self.ttl)
+        if body is None:
+            self.cache.check_offline("flickr:%s" % key)
+            return default
+        return body
+
+    def set(self, key, value, timeout=None):
+        self.cache.set("flickr:%s" % key, value)
+
+class ImageCache(object):
+    """Content addressed store of remote images
+
+    Image data is saved under the SHA-1 of its content, so the same picture
+    served from several URLs is only stored once. An index maps each URL to
+    its content along with the validators needed to revalidate it once it's
+    older than ttl seconds. Install with reportlab.lib.utils.setURLCache so
+    open_for_read looks here instead of going to the network.
+    """
+
+    def __init__(self, path, ttl=7*24*60*60, max_age=30*24*60*60):
+        self.path = path
+        self.ttl = ttl
+        self.max_age = max_age
+        self.lock = threading.RLock()
+        self.index_filename = os.path.join(self.path, "index")
+        self.index = None
+
+    def _load_index(self):
+        if self.index is None:
+            try:
+                f = open(self.index_filename, 'rb')
+                try:
+                    self.index = pickle.load(f)
+                finally:
+                    f.close()
+            except (IOError, EOFError, pickle.UnpicklingError):
+                self.index = {}
+        return self.index
+
+    def save(self):
+        """Write out the index, dropping images that haven't been used in max_age seconds"""
+        self.lock.acquire()
+        try:
+            index = self._load_index()
+            now = time.time()
+            for url, entry in index.items():
+                if now - entry['used'] > self.max_age:
+                    del index[url]
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            temp = "%s.tmp" % self.index_filename
+            f = open(temp, 'wb')
+            try:
+                pickle.dump(index, f, pickle.HIGHEST_PROTOCOL)
+            finally:
+                f.close()
+            os.rename(temp, self.index_filename)
+            # Remove content no URL refers to any more
+            digests = set([entry['digest'] for entry in index.values()])
+            for name in os.listdir(self.path):
+                if len(name) == 40 and name not in digests:
+                    os.remove(os.path.join(self.path, name))
+        finally:
+            self.lock.release()
+
+    def _read_content(self, digest):
+        try:
+            f = open(os.path.join(self.path, digest), 'rb')
+        except IOError:
+            return None
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def _write_content(self, data):
+        digest = sha1(data).hexdigest()
+        filename = os.path.join(self.path, digest)
+        if not os.path.exists(filename):
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            temp = "%s.%s.tmp" % (filename, threading.currentThread().getName())
+            f = open(temp, 'wb')
+            try:
+                f.write(data)
+            finally:
+                f.close()
+            os.rename(temp, filename)
+        return digest
+
+    def read(self, url):
+        """Return the data for an image URL, fetching it only if needed"""
+        self.lock.acquire()
+        try:
+            entry = self._load_index().get(url)
+        finally:
+            self.lock.release()
+        now = time.time()
+        data = None
+        if entry:
+            data = self._read_content(entry['digest'])
+            if data is None:
+                entry = None
+            elif now - entry['fetched'] < self.ttl:
+                entry['used'] = now
+                return data
+
+        request = urllib2.Request(url)
+        if entry:
+            if entry['etag']:
+                request.add_header('If-None-Match', entry['etag'])
+            if entry['last_modified']:
+                request.add_header('If-Modified-Since', entry['last_modified'])
+        try:
+            response = urllib2.urlopen(request)
+            try:
+                data = response.read()
+                info = response.info()
+            finally:
+                response.close()
+            digest = self._write_content(data)
+        except urllib2.HTTPError, e:
+            if not (entry and e.code == 304):
+                raise
+            info = e.headers
+            digest = entry['digest']
+        self.lock.acquire()
+        try:
+            self._load_index()[url] = {
+                'digest': digest,
+                'etag': info.get('ETag', entry and entry['etag']),
+                'last_modified': info.get('Last-Modified', entry and entry['last_modified']),
+                'fetched': now,
+                'used': now,
+            }
+        finally:
+            self.lock.release()
+        return data
+
+    def prefetch(self, urls, threads=8):
+        """Make sure every URL is cached, downloading up to threads at once"""
+        queue = Queue.Queue()
+        for url in set(urls):
+            queue.put(url)
+
+        def work():
+            while True:
+                try:
+                    url = queue.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    self.read(url)
+                except Exception, e:
+                    print u"! %s: %s" % (url, e)
+
+        workers = [threading.Thread(target=work) for i in range(min(threads, queue.qsize()))]
+        for worker in workers:
+            worker.setDaemon(True)
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.save()
+
+http_cache = ResponseCache(os.path.join(CACHE_PATH, "http"))
+image_cache = ImageCache(os.path.join(CACHE_PATH, "images"))
@@ -13,6 +13,7 @@ from operator import itemgetter
 import re
 import time, datetime
 import urllib, urllib2, httplib
+from cStringIO import StringIO
 
 # 3rd party modules
 import pylast
@@ -27,9 +28,23 @@ import feedparser
 
 import flickrapi
 
+# Response cache
+from digestcache import http_cache, FlickrCache
+
 # Settings, keys, passwords
 from settings import *
 
+# Seconds each source's cached responses are served before revalidating
+CACHE_TTLS = {
+    'tube':         5*60,
+    'twitter':      5*60,
+    'newsgator':    15*60,
+    'gcal':         30*60,
+    'lastfm':       60*60,
+    'weather':      60*60,
+    'flickr':       6*60*60,
+}
+
 def lastfm_auth():
     """Authenticate with the Last.fm API"""
     
@@ -46,9 +61,34 @@ def lastfm_auth():
     print data
 
 def lastfm_event_recommendations():
-    """Fetch a list of event recommendations for today from Last.fm"""
+    """Fetch a list of event recommendations for today from Last.fm
+    
+    pylast fetches each event's details lazily, so they're all read here and
+    returned as plain dicts, leaving nothing to fetch when they're formatted.
+    pylast doesn't go through http_cache, so the dicts are cached instead.
+    """
+    key = "lastfm:recommended-events"
+    events = http_cache.get(key, CACHE_TTLS['lastfm'])
+    if events is not None:
+        return events
+    http_cache.check_offline(key)
     user = pylast.User('jwheare', LASTFM_KEY, LASTFM_SECRET, LASTFM_SESSION)
-    events = user.getRecommendedEvents(limit=6)
+    events = []
+    for e in user.getRecommendedEvents(limit=6):
+        try:
+            events.append({
+                'id': e.getID(),
+                'title': e.getTitle(),
+                'start_date': e.getStartDate(),
+                'image': e.getImage(pylast.IMAGE_SMALL),
+                'artists': e._getFromInfo('artists'),
+                'venue': e.getVenueName(),
+                'postcode': e.getPostalCode(),
+                'geo_point': e.getGeoPoint(),
+            })
+        except (pylast.ServiceException, httplib.BadStatusLine), exc:
+            print u'! FAILED - %s (%s)' % (exc, e.getID())
+    http_cache.set(key, events)
     return events
 
 def get_tube_colors():
@@ -72,9 +112,11 @@ def get_tube_colors():
 def tube_status():
     """Fetch Tube status from TFL"""
     url = "http://www.tfl.gov.uk/tfl/livetravelnews/realtime/tube/later.html"
-    soup = BeautifulSoup(urllib.urlopen(url), markupMassage=BeautifulSoup.MARKUP_MASSAGE,
+    # Stop parsing as soon as the service board has been read
+    soup = BeautifulSoup(StringIO(http_cache.fetch(url, CACHE_TTLS['tube'])), markupMassage=BeautifulSoup.MARKUP_MASSAGE,
         parseOnlyThese=SoupStrainer("div", { "id": "service-board" }),
-        convertEntities=BeautifulStoneSoup.HTML_ENTITIES)
+        convertEntities=BeautifulStoneSoup.HTML_ENTITIES, buildIndex=True,
+        incremental=True, stopAfterMatch=True)
     
     # Parse line status
     lines = soup.find("dl", { "id": "lines" }).findAll("dt")
@@ -111,7 +153,7 @@ def twitter_friends():
     opener = urllib2.build_opener(authhandler)
     
     try:
-        json = opener.open(url).read()
+        json = http_cache.fetch(url, CACHE_TTLS['twitter'], opener)
         statuses = simplejson.loads(json)
         return statuses
     except urllib2.HTTPError, e:
@@ -131,7 +173,7 @@ def newsgator_headlines():
         ('X-NGAPIToken', NEWSGATOR_KEY)
     ]
     try:
-        data = feedparser.parse(opener.open(url))
+        data = feedparser.parse(http_cache.fetch(url, CACHE_TTLS['newsgator'], opener))
         return data
     except urllib2.HTTPError, e:
         print e
@@ -141,7 +183,18 @@ def gcal_events():
     calendar_service = gdata.calendar.service.CalendarService()
     calendar_service.email = GCAL_USERNAME
     calendar_service.password = GCAL_PASSWORD
-    calendar_service.ProgrammaticLogin()
+    
+    def fetch_feed(uri):
+        # Only log in when a feed actually needs fetching
+        body = http_cache.get(uri, CACHE_TTLS['gcal'])
+        if body is None:
+            http_cache.check_offline(uri)
+            if not calendar_service.GetClientLoginToken():
+                calendar_service.ProgrammaticLogin()
+            body = http_cache.fetch(uri, CACHE_TTLS['gcal'], headers={
+                'Authorization': 'GoogleLogin auth=%s' % calendar_service.GetClientLoginToken(),
+            })
+        return gdata.calendar.CalendarEventFeedFromString(body)
     
     # feed = calendar_service.GetAllCalendarsFeed()
     # for i, calendar in enumerate(feed.entry):
@@ -161,7 +214,7 @@ def gcal_events():
         query.sortorder = 'ascending'
         
         try:
-            feed = calendar_service.CalendarQuery(query)
+            feed = fetch_feed("http://%s%s" % (calendar_service.server, query.ToUri()))
             # print feed
             for event in feed.entry:
                 if event.when:
@@ -190,23 +243,24 @@ def gcal_events():
                             event_info['allday'] = True
                     event_info['start'] = start
                     events.append(event_info)
-        except httplib.BadStatusLine, e:
+        except (httplib.BadStatusLine, urllib2.URLError), e:
             print "! %s" % e
     events.sort(key=itemgetter('start'))
     return events
 
 def weather():
     forecast_url = "http://feeds.bbc.co.uk/weather/feeds/rss/5day/world/%s.xml" % BBC_WEATHER_LOCATION
-    forecast_data = feedparser.parse(urllib.urlopen(forecast_url))
+    forecast_data = feedparser.parse(http_cache.fetch(forecast_url, CACHE_TTLS['weather']))
     
     warning_url = "http://www.metoffice.gov.uk/xml/warnings_rss_%s.xml" % MET_WEATHER_REGION
-    warning_data = feedparser.parse(urllib.urlopen(warning_url))
+    warning_data = feedparser.parse(http_cache.fetch(warning_url, CACHE_TTLS['weather']))
     
     return forecast_data, warning_data
 
 def flickr_auth():
     """Authenticate with the Flickr API"""
     flickr = flickrapi.FlickrAPI(FLICKR_KEY, FLICKR_SECRET)
+    flickr.cache = FlickrCache(http_cache, CACHE_TTLS['flickr'])
     
     token, frob = flickr.get_token_part_one(perms='read')
     if not token:
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+digestrecord.py
+Record the HTTP traffic of a digest run and replay it later without the network
+"""
+
+import sitecustomize
+
+# Builtin modules
+import os
+import re
+import httplib
+import socket
+import threading
+import cPickle as pickle
+from cStringIO import StringIO
+from hashlib import sha1
+from urlparse import urlsplit
+
+class _Socket(object):
+    """Just enough of a socket for httplib.HTTPResponse to read a recorded response from"""
+
+    def __init__(self, data):
+        self.data = data
+
+    def makefile(self, *args, **kwargs):
+        return StringIO(self.data)
+
+# ClientLogin answers with these tokens, one per line
+SECRET_LINES = re.compile(r'^(Auth|SID|LSID)=[^\r\n]*', re.M)
+
+def _redact(request, recording):
+    """Blank out the tokens in a login response so they aren't saved"""
+    status, reason, headers, body = recording
+    if request[2].endswith('/ClientLogin'):
+        body = SECRET_LINES.sub(r'\1=REDACTED', body)
+    return status, reason, headers, body
+
+def _response(recording, method):
+    """Turn a recorded (status, reason, headers, body) into a real HTTPResponse"""
+    status, reason, headers, body = recording
+    data = "HTTP/1.1 %d %s\r\n%sContent-Length: %d\r\n\r\n%s" % (
+        status, reason, "".join(headers), len(body), body)
+    response = httplib.HTTPResponse(_Socket(data), method=method)
+    response.begin()
+    return response
+
+class Session(object):
+    """Records or replays every request made through httplib
+
+    All the sources (urllib, urllib2 openers, flickrapi, pylast, feedparser
+    and gdata) end up in httplib.HTTPConnection, so patching that covers them
+    all. When recording, each response is read in full and kept along with a
+    description of its request, and the lot is saved to filename on stop.
+    When replaying, nothing touches the network. Each request gets the first
+    unused recording with the same method, host, path, query and body, or
+    failing that the same method, host and path, since queries often carry
+    dates and timestamps. Request bodies are only kept as a hash, so
+    passwords posted to login pages aren't saved, and the Auth, SID and LSID
+    tokens in Google ClientLogin responses are redacted before saving.
+    Replayed logins get placeholder tokens, which is fine as requests are
+    matched without their headers.
+    """
+
+    def __init__(self, filename, mode='replay'):
+        if mode not in ('record', 'replay'):
+            raise ValueError("mode must be 'record' or 'replay', not %r" % mode)
+        self.filename = filename
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.used = set()
+        self.originals = {}
+        if mode == 'replay':
+            f = open(filename, 'rb')
+            try:
+                self.recordings = pickle.load(f)
+            finally:
+                f.close()
+        else:
+            self.recordings = []
+
+    def _request(self, conn):
+        method, url, body = conn._digest_request
+        parts = urlsplit(url)
+        return (method, "%s:%s" % (conn.host, conn.port), parts.path, parts.query,
+            sha1("".join(body)).hexdigest())
+
+    def _find(self, request):
+        self.lock.acquire()
+        try:
+            # Exact matches, then any for the same path, then reuse one already given out
+            for length, unused in ((5, True), (3, True), (3, False)):
+                for i, (recorded, response) in enumerate(self.recordings):
+                    if recorded[:length] == request[:length] and not (unused and i in self.used):
+                        self.used.add(i)
+                        return response
+        finally:
+            self.lock.release()
+        raise socket.error("No recording of %s http://%s%s" % request[:3])
+
+    def _patch(self, cls, name, method):
+        self.originals[(cls, name)] = cls.__dict__[name]
+        setattr(cls, name, method)
+
+    def start(self):
+        """Patch httplib so every connection goes through this session"""
+        session = self
+        original = dict(httplib.HTTPConnection.__dict__)
+        replaying = self.mode == 'replay'
+
+        def putrequest(conn, method, url, *args, **kwargs):
+            conn._digest_request = (method, url, [])
+            conn._digest_sending = False
+            if not replaying:
+                original['putrequest'](conn, method, url, *args, **kwargs)
+
+        def putheader(conn, *args, **kwargs):
+            if not replaying:
+                original['putheader'](conn, *args, **kwargs)
+
+        def endheaders(conn, message_body=None):
+            if message_body:
+                conn._digest_request[2].append(message_body)
+            if not replaying:
+                if message_body is None:
+                    original['endheaders'](conn)
+                else:
+                    original['endheaders'](conn, message_body)
+            # Anything sent from now on is body
+            conn._digest_sending = True
+
+        def send(conn, data):
+            if getattr(conn, '_digest_sending', False):
+                conn._digest_request[2].append(data)
+            if not replaying:
+                original['send'](conn, data)
+
+        def connect(conn):
+            pass
+
+        def getresponse(conn, *args, **kwargs):
+            request = session._request(conn)
+            if replaying:
+                recording = session._find(request)
+            else:
+                response = original['getresponse'](conn, *args, **kwargs)
+                try:
+                    body = response.read()
+                finally:
+                    response.close()
+                headers = [line for line in response.msg.headers
+                    if line.split(':', 1)[0].strip().lower() not in ('content-length', 'transfer-encoding')]
+                recording = (response.status, response.reason, headers, body)
+                session.lock.acquire()
+                try:
+                    session.recordings.append((request, _redact(request, recording)))
+                finally:
+                    session.lock.release()
+            return _response(recording, request[0])
+
+        self._patch(httplib.HTTPConnection, 'putrequest', putrequest)
+        self._patch(httplib.HTTPConnection, 'putheader', putheader)
+        self._patch(httplib.HTTPConnection, 'endheaders', endheaders)
+        self._patch(httplib.HTTPConnection, 'send', send)
+        self._patch(httplib.HTTPConnection, 'getresponse', getresponse)
+        if replaying:
+            self._patch(httplib.HTTPConnection, 'connect', connect)
+            if hasattr(httplib, 'HTTPSConnection'):
+                self._patch(httplib.HTTPSConnection, 'connect', connect)
+
+    def stop(self):
+        """Put httplib back, and save the recordings if we were making them"""
+        for (cls, name), method in self.originals.items():
+            setattr(cls, name, method)
+        self.originals = {}
+        if self.mode == 'record':
+            self.save()
+
+    def save(self):
+        self.lock.acquire()
+        try:
+            temp = "%s.tmp" % self.filename
+            f = open(temp, 'wb')
+            try:
+                pickle.dump(self.recordings, f, pickle.HIGHEST_PROTOCOL)
+            finally:
+                f.close()
+            os.rename(temp, self.filename)
+        finally:
+            self.lock.release()
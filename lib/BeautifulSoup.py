@@ -88,6 +88,7 @@ import codecs
 import types
 import re
 import sgmllib
+from bisect import bisect_left, bisect_right
 try:
   from htmlentitydefs import name2codepoint
 except ImportError:
@@ -104,6 +105,9 @@ class PageElement:
     """Contains the navigational information for some part of the page
     (either a tag or a piece of text)"""
 
+    # The TagIndex of the soup this element was parsed into, if it has one
+    _index = None
+
     def setup(self, parent=None, previous=None):
         """Sets up the initial relations between this element and
         other elements."""
@@ -132,6 +136,8 @@ class PageElement:
 
     def extract(self):
         """Destructively rips this element out of the tree."""
+        if self._index is not None:
+            self._index.invalidate()
         if self.parent:
             try:
                 self.parent.contents.remove(self)
@@ -171,6 +177,8 @@ class PageElement:
             or isinstance(newChild, unicode)) \
             and not isinstance(newChild, NavigableString):
             newChild = NavigableString(newChild)
+        if self._index is not None:
+            self._index.invalidate()
 
         position =  min(position, len(self.contents))
         if hasattr(newChild, 'parent') and newChild.parent != None:
@@ -320,14 +328,19 @@ class PageElement:
             # Build a SoupStrainer
             strainer = SoupStrainer(name, attrs, text, **kwargs)
         results = ResultSet(strainer)
-        g = generator()
+        search = strainer.compile()
+        g = None
+        if self._index:
+            g = self._index.generator(strainer, self, generator)
+        if g is None:
+            g = generator()
         while True:
             try:
                 i = g.next()
             except StopIteration:
                 break
             if i:
-                found = strainer.search(i)
+                found = search(i)
                 if found:
                     results.append(found)
                     if limit and len(results) >= limit:
@@ -535,6 +548,8 @@ class Tag(PageElement):
     def __setitem__(self, key, value):
         """Setting tag[key] sets the value of the 'key' attribute for the
         tag."""
+        if self._index is not None and key in TagIndex.ATTRS:
+            self._index.invalidate()
         self._getAttrMap()
         self.attrMap[key] = value
         found = False
@@ -548,6 +563,8 @@ class Tag(PageElement):
 
     def __delitem__(self, key):
         "Deleting tag[key] deletes all 'key' attributes for the tag."
+        if self._index is not None and key in TagIndex.ATTRS:
+            self._index.invalidate()
         for item in self.attrs:
             if item[0] == key:
                 self.attrs.remove(item)
@@ -769,7 +786,9 @@ class Tag(PageElement):
     def _getAttrMap(self):
         """Initializes a map representation of this tag's attributes,
         if not already initialized."""
-        if not getattr(self, 'attrMap'):
+        # Look in __dict__ so a missing map doesn't go through __getattr__,
+        # which would search the tag's contents for an <attrMap> tag.
+        if not self.__dict__.get('attrMap'):
             self.attrMap = {}
             for (key, value) in self.attrs:
                 self.attrMap[key] = value
@@ -884,6 +903,98 @@ class SoupStrainer:
                   % markup.__class__
         return found
 
+    def compile(self):
+        """Returns a function that does what search does for a single tag
+        or string, with the checks on what kind of thing each criterion
+        is done once here rather than again for every element."""
+        cls = self.__class__
+        for method in ('search', 'searchTag', '_matches'):
+            if getattr(cls, method).im_func is not getattr(SoupStrainer, method).im_func:
+                # A subclass changed the rules
+                return self.search
+        textMatches = self._compileMatches(self.text)
+        if self.text:
+            tagMatches = None
+        else:
+            nameMatches = None
+            if self.name:
+                nameMatches = self._compileMatches(self.name)
+            attrMatches = [(attr, self._compileMatches(matchAgainst))
+                           for attr, matchAgainst in (self.attrs or {}).items()]
+            def tagMatches(markup):
+                if nameMatches and not nameMatches(markup):
+                    return False
+                if attrMatches:
+                    attrMap = markup._getAttrMap()
+                    for attr, matches in attrMatches:
+                        if not matches(attrMap.get(attr)):
+                            return False
+                return True
+        search = self.search
+        def compiled(markup):
+            if isinstance(markup, Tag):
+                if tagMatches and tagMatches(markup):
+                    return markup
+            elif isinstance(markup, basestring):
+                if textMatches(markup):
+                    return markup
+            else:
+                return search(markup)
+            return None
+        return compiled
+
+    def _compileMatches(self, matchAgainst):
+        """Returns a function of markup that gives the same answer as
+        _matches(markup, matchAgainst)."""
+        if matchAgainst == True and type(matchAgainst) == types.BooleanType:
+            return lambda markup: markup != None
+        elif callable(matchAgainst):
+            return matchAgainst
+        elif matchAgainst is None:
+            # Nothing but None equals None
+            return lambda markup: markup is None
+        elif hasattr(matchAgainst, 'match'):
+            # It's a regexp object.
+            search = matchAgainst.search
+            def matches(markup):
+                if isinstance(markup, Tag):
+                    markup = markup.name
+                elif markup and not isString(markup):
+                    markup = unicode(markup)
+                return markup and search(markup)
+            return matches
+        elif isList(matchAgainst):
+            try:
+                members = frozenset(matchAgainst)
+            except TypeError:
+                members = matchAgainst
+            def matches(markup):
+                if isinstance(markup, Tag):
+                    markup = markup.name
+                elif markup and not isString(markup):
+                    markup = unicode(markup)
+                return markup in members
+            return matches
+        elif matchAgainst and isString(matchAgainst):
+            try:
+                asUnicode = unicode(matchAgainst)
+                asStr = str(matchAgainst)
+            except UnicodeError:
+                # Leave any complaint for when it's actually matched
+                return lambda markup: self._matches(markup, matchAgainst)
+            def matches(markup):
+                if isinstance(markup, Tag):
+                    markup = markup.name
+                elif markup and not isString(markup):
+                    markup = unicode(markup)
+                if isinstance(markup, unicode):
+                    return asUnicode == markup
+                elif isinstance(markup, str):
+                    return asStr == markup
+                return matchAgainst == markup
+            return matches
+        return lambda markup: self._matches(markup, matchAgainst)
+
     def _matches(self, markup, matchAgainst):
         #print "Matching %s against %s" % (markup, matchAgainst)
         result = False
@@ -923,6 +1034,127 @@ class ResultSet(list):
         list.__init__([])
         self.source = source
 
+class TagIndex:
+    """Maps tag names, ids and classes to the tags of a parsed document,
+    in document order, so searches that name one of them needn't walk
+    the whole tree.
+
+    Each tag gets its position in the document and the position of the
+    last tag inside it, so the tags under any other tag, or after it,
+    are a slice of each list. Changing the tree after it's parsed turns
+    the index off, and searches go back to walking the tree."""
+
+    ATTRS = ('id', 'class')
+    EMPTY = ([], [])
+
+    def __init__(self):
+        self.count = 0
+        self.complete = False
+        self.valid = True
+        # Each maps a key to a list of positions and a list of tags
+        self.names = {}
+        self.ids = {}
+        self.classes = {}
+        # Merged lists for names given as lists or regular expressions
+        self.unions = {}
+
+    def __nonzero__(self):
+        return self.complete and self.valid
+
+    def _add(self, table, key, tag):
+        positions, tags = table.setdefault(key, ([], []))
+        positions.append(tag._indexPosition)
+        tags.append(tag)
+
+    def add(self, tag):
+        "Records a tag just created by the parser."
+        tag._index = self
+        tag._indexPosition = tag._indexEnd = self.count
+        self.count = self.count + 1
+        self._add(self.names, tag.name, tag)
+        for key, value in tag.attrs:
+            if key == 'id':
+                self._add(self.ids, value, tag)
+            elif key == 'class':
+                self._add(self.classes, value, tag)
+
+    def close(self, tag):
+        "Records that the parser has seen the last of a tag's contents."
+        if tag._index is self:
+            tag._indexEnd = self.count - 1
+
+    def invalidate(self):
+        self.valid = False
+
+    def _union(self, key, names):
+        found = self.unions.get(key)
+        if found is None:
+            merged = []
+            for name in names:
+                positions, tags = self.names[name]
+                merged.extend(zip(positions, tags))
+            merged.sort()
+            found = self.unions[key] = ([p for p, t in merged],
+                                        [t for p, t in merged])
+        return found
+
+    def candidates(self, strainer):
+        """Returns positions and tags for every tag that could match the
+        strainer, or None if the index can't narrow it down."""
+        if strainer.text:
+            return None
+        attrs = strainer.attrs or {}
+        for attr, table in (('id', self.ids), ('class', self.classes)):
+            value = attrs.get(attr)
+            if isString(value):
+                return table.get(value, self.EMPTY)
+        name = strainer.name
+        if not name or callable(name):
+            return None
+        if isString(name):
+            return self.names.get(name, self.EMPTY)
+        if hasattr(name, 'match'):
+            return self._union(('re', name.pattern, name.flags),
+                               [n for n in self.names if name.search(n)])
+        if isList(name):
+            return self._union(('list',) + tuple(name),
+                               [n for n in self.names if n in name])
+        return None
+
+    def generator(self, strainer, element, generator):
+        """Returns a generator over the tags the given element generator
+        would reach that could match the strainer, or None if the index
+        can't help."""
+        if not (self and isinstance(element, Tag) and element._index is self):
+            return None
+        kind = generator.__name__
+        parent = None
+        if kind == 'recursiveChildGenerator':
+            start, end = element._indexPosition + 1, element._indexEnd
+        elif kind == 'childGenerator':
+            start, end = element._indexPosition + 1, element._indexEnd
+            parent = element
+        elif kind == 'nextGenerator':
+            start, end = element._indexPosition + 1, self.count - 1
+        elif kind == 'nextSiblingGenerator' and element.parent \
+                 and element.parent._index is self:
+            start, end = element._indexEnd + 1, element.parent._indexEnd
+            parent = element.parent
+        else:
+            return None
+        found = self.candidates(strainer)
+        if found is None:
+            return None
+        return self._slice(found, start, end, parent)
+
+    def _slice(self, found, start, end, parent):
+        positions, tags = found
+        for i in xrange(bisect_left(positions, start),
+                        bisect_right(positions, end)):
+            tag = tags[i]
+            if parent is None or tag.parent is parent:
+                yield tag
+
 # Now, some helper functions.
 
 def isList(l):
@@ -991,6 +1223,13 @@ class BeautifulStoneSoup(Tag, SGMLParser):
 
     ROOT_TAG_NAME = u'[document]'
 
+    # How much of a file-type object to read at a time when parsing
+    # incrementally
+    CHUNK_SIZE = 16384
+
+    # Whether UnicodeDammit should look for a META tag's charset
+    IS_HTML = False
+
     HTML_ENTITIES = "html"
     XML_ENTITIES = "xml"
     XHTML_ENTITIES = "xhtml"
@@ -1005,7 +1244,8 @@ class BeautifulStoneSoup(Tag, SGMLParser):
 
     def __init__(self, markup="", parseOnlyThese=None, fromEncoding=None,
                  markupMassage=True, smartQuotesTo=XML_ENTITIES,
-                 convertEntities=None, selfClosingTags=None):
+                 convertEntities=None, selfClosingTags=None, buildIndex=False,
+                 incremental=False, stopAfterMatch=False):
         """The Soup object is initialized as the 'root tag', and the
         provided markup (which can be a string or a file-like object)
         is fed into the underlying parser.
@@ -1029,9 +1269,23 @@ class BeautifulStoneSoup(Tag, SGMLParser):
 
         You can pass in a custom list of (RE object, replace method)
         tuples to get Beautiful Soup to scrub your input the way you
-        want."""
+        want.
+
+        If buildIndex is true, a TagIndex of the tags by name, id and
+        class is built as the document is parsed, and searches use it
+        where they can instead of walking the tree.
+
+        If incremental is true and markup is a file-type object, it's
+        read, converted, massaged and parsed CHUNK_SIZE bytes at a
+        time instead of all at once. Massage regexes then only ever
+        see whole tags, so they mustn't span more than one. If
+        stopAfterMatch is true, parsing stops as soon as the first tag
+        matching parseOnlyThese has been closed, and no more of the
+        file is read."""
 
         self.parseOnlyThese = parseOnlyThese
+        self.buildIndex = buildIndex
+        self.stopAfterMatch = stopAfterMatch
         self.fromEncoding = fromEncoding
         self.smartQuotesTo = smartQuotesTo
         self.convertEntities = convertEntities
@@ -1062,15 +1316,17 @@ class BeautifulStoneSoup(Tag, SGMLParser):
         self.instanceSelfClosingTags = buildTagMap(None, selfClosingTags)
         SGMLParser.__init__(self)
 
-        if hasattr(markup, 'read'):        # It's a file-type object.
-            markup = markup.read()
+        if hasattr(markup, 'read') and not incremental:
+            markup = markup.read()         # It's a file-type object.
         self.markup = markup
         self.markupMassage = markupMassage
+        self.rawMarkup = []
         try:
             self._feed()
         except StopParsing:
             pass
         self.markup = None                 # The markup can now be GCed
+        self.rawMarkup = None
 
     def convert_charref(self, name):
         """This method fixes a bug in Python's SGMLParser."""
@@ -1083,6 +1339,8 @@ class BeautifulStoneSoup(Tag, SGMLParser):
         return self.convert_codepoint(n)
 
     def _feed(self, inDocumentEncoding=None):
+        if hasattr(self.markup, 'read'):
+            return self._feedIncrementally(inDocumentEncoding)
         # Convert the document to Unicode.
         markup = self.markup
         if isinstance(markup, unicode):
@@ -1091,9 +1349,9 @@ class BeautifulStoneSoup(Tag, SGMLParser):
         else:
             dammit = UnicodeDammit\
                      (markup, [self.fromEncoding, inDocumentEncoding],
-                      smartQuotesTo=self.smartQuotesTo)
+                      smartQuotesTo=self.smartQuotesTo, isHTML=self.IS_HTML)
             markup = dammit.unicode
-            self.originalEncoding = dammit.originalEncoding
+            self._noteEncoding(dammit)
         if markup:
             if self.markupMassage:
                 if not isList(self.markupMassage):
@@ -1108,11 +1366,111 @@ class BeautifulStoneSoup(Tag, SGMLParser):
                 del(self.markupMassage)
         self.reset()
 
-        SGMLParser.feed(self, markup)
+        try:
+            SGMLParser.feed(self, markup)
+        except StopParsing:
+            pass
+        self._finish()
+
+    def _feedIncrementally(self, inDocumentEncoding=None):
+        """Reads, converts, massages and parses the markup file a chunk
+        at a time, so parsing can stop without reading the rest."""
+        markupMassage = self.markupMassage
+        if markupMassage and not isList(markupMassage):
+            markupMassage = self.MARKUP_MASSAGE
+        if not hasattr(self, 'originalEncoding'):
+            self.originalEncoding = None
+        self.reset()
+
+        dammit = None
+        undecoded = ''
+        unfinished = u''
+        try:
+            self.moreMarkup = True
+            for chunk in self._readChunks():
+                if isinstance(chunk, unicode):
+                    markup = chunk
+                elif dammit is None:
+                    # Wait for enough of the start to tell the encoding
+                    undecoded += chunk
+                    if len(undecoded) < UnicodeDammit.SNIFF_SIZE:
+                        continue
+                    dammit = UnicodeDammit\
+                             (undecoded, [self.fromEncoding, inDocumentEncoding],
+                              smartQuotesTo=self.smartQuotesTo, final=False,
+                              isHTML=self.IS_HTML)
+                    markup = dammit.unicode
+                    self._noteEncoding(dammit)
+                else:
+                    markup = dammit.decode(chunk)
+                markup = unfinished + markup
+                unfinished = u''
+                if markupMassage:
+                    # Hold back a tag that hasn't been closed yet.
+                    start = markup.rfind('<')
+                    if start != -1 and markup.find('>', start) == -1:
+                        markup, unfinished = markup[:start], markup[start:]
+                SGMLParser.feed(self, self._massage(markup, markupMassage))
+            self.moreMarkup = False
+            if dammit is not None:
+                unfinished += dammit.decode('', True)
+            elif undecoded:
+                # The whole document was shorter than SNIFF_SIZE
+                dammit = UnicodeDammit\
+                         (undecoded, [self.fromEncoding, inDocumentEncoding],
+                          smartQuotesTo=self.smartQuotesTo, isHTML=self.IS_HTML)
+                unfinished = dammit.unicode
+                self._noteEncoding(dammit)
+            SGMLParser.feed(self, self._massage(unfinished, markupMassage))
+        except StopParsing:
+            pass
+        except UnicodeDecodeError:
+            # The start of the document was misleading about its
+            # encoding, so read the rest and convert it all at once.
+            self.markup = ''.join(self.rawMarkup) + self.markup.read()
+            return self._feed(inDocumentEncoding)
+        if self.markupMassage:
+            del(self.markupMassage)
+        self._finish()
+
+    def _noteEncoding(self, dammit):
+        self.originalEncoding = dammit.originalEncoding
+        if dammit.declaredHTMLEncoding and dammit.originalEncoding == \
+               dammit.find_codec(dammit.declaredHTMLEncoding):
+            # The META tag's charset has been used already, so there's
+            # no need for start_meta to go through the document again.
+            self.declaredHTMLEncoding = dammit.declaredHTMLEncoding
+
+    def _readChunks(self):
+        """Yields the markup file a chunk at a time, starting with any
+        chunks already read by an earlier pass over the document."""
+        i = 0
+        while True:
+            if i < len(self.rawMarkup):
+                chunk = self.rawMarkup[i]
+            else:
+                chunk = self.markup.read(self.CHUNK_SIZE)
+                if not chunk:
+                    return
+                self.rawMarkup.append(chunk)
+            i += 1
+            yield chunk
+
+    def _massage(self, markup, markupMassage):
+        if markup and markupMassage:
+            for fix, m in markupMassage:
+                markup = fix.sub(m, markup)
+        return markup
+
+    def _finish(self):
         # Close out any unfinished strings and close all the open tags.
+        self.finishing = True
         self.endData()
         while self.currentTag.name != self.ROOT_TAG_NAME:
             self.popTag()
+        if self._index is not None:
+            self._index.close(self)
+            self._index.complete = True
 
     def __getattr__(self, methodName):
         """This method routes method call requests to either the SGMLParser
@@ -1136,15 +1494,22 @@ class BeautifulStoneSoup(Tag, SGMLParser):
     def reset(self):
         Tag.__init__(self, self, self.ROOT_TAG_NAME)
         self.hidden = 1
+        if self.buildIndex:
+            TagIndex().add(self)
         SGMLParser.reset(self)
         self.currentData = []
         self.currentTag = None
         self.tagStack = []
         self.quoteStack = []
+        self.finishing = False
+        # True while an incremental parse has more of the document to come
+        self.moreMarkup = False
         self.pushTag(self)
 
     def popTag(self):
         tag = self.tagStack.pop()
+        if tag._index is not None:
+            tag._index.close(tag)
         # Tags with just one string-owning child get the child as a
         # 'string' property, so that soup.tag.string is shorthand for
         # soup.tag.contents[0]
@@ -1155,6 +1520,10 @@ class BeautifulStoneSoup(Tag, SGMLParser):
         #print "Pop", tag.name
         if self.tagStack:
             self.currentTag = self.tagStack[-1]
+        if self.stopAfterMatch and self.parseOnlyThese \
+               and len(self.tagStack) == 1 and not self.finishing:
+            # The tag we were looking for is complete.
+            raise StopParsing
         return self.currentTag
 
     def pushTag(self, tag):
@@ -1271,6 +1640,8 @@ class BeautifulStoneSoup(Tag, SGMLParser):
             return
 
         tag = Tag(self, name, attrs, self.currentTag, self.previous)
+        if self._index is not None:
+            self._index.add(tag)
         if self.previous:
             self.previous.next = tag
         self.previous = tag
@@ -1380,6 +1751,8 @@ class BeautifulStoneSoup(Tag, SGMLParser):
         if self.rawdata[i:i+9] == '<![CDATA[':
              k = self.rawdata.find(']]>', i)
              if k == -1:
+                 if self.moreMarkup:
+                     return -1
                  k = len(self.rawdata)
              data = self.rawdata[i+9:k]
              j = k+3
@@ -1388,6 +1761,8 @@ class BeautifulStoneSoup(Tag, SGMLParser):
             try:
                 j = SGMLParser.parse_declaration(self, i)
             except SGMLParseError:
+                if self.moreMarkup:
+                    return -1
                 toHandle = self.rawdata[i:]
                 self.handle_data(toHandle)
                 j = i + len(toHandle)
@@ -1452,6 +1827,8 @@ class BeautifulSoup(BeautifulStoneSoup):
 
     QUOTE_TAGS = {'script' : None, 'textarea' : None}
 
+    IS_HTML = True
+
     #According to the HTML standard, each of these inline tags can
     #contain another tag of the same type. Furthermore, it's common
     #to actually use these tags this way.
@@ -1686,23 +2063,52 @@ class UnicodeDammit:
     CHARSET_ALIASES = { "macintosh" : "mac-roman",
                         "x-sjis" : "shift-jis" }
 
+    XML_ENCODING_RE = re.compile('^<\?.*encoding=[\'"](.*?)[\'"].*\?>')
+    META_TAG_RE = re.compile('<meta\s[^>]*>', re.I)
+    META_ATTRIBUTE_RE = re.compile \
+                        ('([-:.\w]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]*))')
+
+    # How much of the start of a document to look at for byte order
+    # marks and declarations, and to try each proposed encoding on
+    # before converting the whole thing
+    SNIFF_SIZE = 8192
+
     def __init__(self, markup, overrideEncodings=[],
-                 smartQuotesTo='xml'):
-        self.markup, documentEncoding, sniffedEncoding = \
-                     self._detectEncoding(markup)
+                 smartQuotesTo='xml', final=True, isHTML=False):
+        """If final is false, markup is only the start of the
+        document, and the rest is converted a piece at a time with
+        decode(). If isHTML is true, the charset of a META tag near
+        the start of the document is tried straight after
+        overrideEncodings."""
         self.smartQuotesTo = smartQuotesTo
+        self.final = final
+        self.decoder = None
+        self.declaredHTMLEncoding = None
         self.triedEncodings = []
         if markup == '' or isinstance(markup, unicode):
+            self.markup = markup
             self.originalEncoding = None
             self.unicode = unicode(markup)
             return
 
+        self.markup, documentEncoding, sniffedEncoding, \
+                     self.declaredHTMLEncoding = \
+                     self._detectEncoding(markup, isHTML)
+        if not final:
+            # The rest of the document will arrive as it is, so convert
+            # the start as it is too. A start that's all ASCII says
+            # nothing about the rest, which is most likely UTF-8.
+            self.markup = markup
+            if sniffedEncoding == 'ascii':
+                sniffedEncoding = 'utf-8'
+
         u = None
         for proposedEncoding in overrideEncodings:
             u = self._convertFrom(proposedEncoding)
             if u: break
         if not u:
-            for proposedEncoding in (documentEncoding, sniffedEncoding):
+            for proposedEncoding in (self.declaredHTMLEncoding,
+                                     documentEncoding, sniffedEncoding):
                 u = self._convertFrom(proposedEncoding)
                 if u: break
 
@@ -1736,18 +2142,21 @@ class UnicodeDammit:
         self.triedEncodings.append(proposed)
         markup = self.markup
 
-        # Convert smart quotes to HTML if coming from an encoding
-        # that might have them.
-        if self.smartQuotesTo and proposed.lower() in("windows-1252",
-                                                      "iso-8859-1",
-                                                      "iso-8859-2"):
-            markup = re.compile("([\x80-\x9f])").sub \
-                     (lambda(x): self._subMSChar(x.group(1)),
-                      markup)
-
         try:
             # print "Trying to convert document to %s" % proposed
-            u = self._toUnicode(markup, proposed)
+            if self.final and len(markup) > self.SNIFF_SIZE:
+                # Rule out the wrong encodings on the start of the
+                # document before converting the whole thing. The
+                # start may well end part way through a character.
+                sample = self._convertSmartQuotes\
+                         (markup[:self.SNIFF_SIZE], proposed)
+                try:
+                    self._toUnicode(sample, proposed)
+                except UnicodeDecodeError, e:
+                    if e.start < len(sample) - 8:
+                        raise
+            markup = self._convertSmartQuotes(markup, proposed)
+            u = self._toUnicode(markup, proposed, self.final)
             self.markup = u
             self.originalEncoding = proposed
         except Exception, e:
@@ -1757,9 +2166,28 @@ class UnicodeDammit:
         #print "Correct encoding: %s" % proposed
         return self.markup
 
-    def _toUnicode(self, data, encoding):
+    def decode(self, data, final=False):
+        """Converts the next piece of a document whose start was
+        passed in with final false."""
+        data = self._convertSmartQuotes(data, self.originalEncoding)
+        return self.decoder.decode(data, final)
+
+    def _convertSmartQuotes(self, markup, encoding):
+        # Convert smart quotes to HTML if coming from an encoding
+        # that might have them.
+        if self.smartQuotesTo and encoding.lower() in("windows-1252",
+                                                      "iso-8859-1",
+                                                      "iso-8859-2") \
+               and len(markup.translate(None, self.MS_CHAR_BYTES)) < len(markup):
+            for orig in self.MS_CHARS.keys():
+                if orig in markup:
+                    markup = markup.replace(orig, self._subMSChar(orig))
+        return markup
+
+    def _toUnicode(self, data, encoding, final=True):
         '''Given a string and its encoding, decodes the string into Unicode.
-        %encoding is a string recognized by encodings.aliases'''
+        %encoding is a string recognized by encodings.aliases. If final
+        is false, the string is only the start of the document.'''
 
         # strip Byte Order Mark (if present)
         if (len(data) >= 4) and (data[:2] == '\xfe\xff') \
@@ -1779,60 +2207,71 @@ class UnicodeDammit:
         elif data[:4] == '\xff\xfe\x00\x00':
             encoding = 'utf-32le'
             data = data[4:]
-        newdata = unicode(data, encoding)
+        if final:
+            newdata = unicode(data, encoding)
+        else:
+            # The last character may be cut off, and finished by the
+            # next piece of the document.
+            self.decoder = codecs.getincrementaldecoder(encoding)()
+            newdata = self.decoder.decode(data)
+            if data and not newdata:
+                raise UnicodeError("Not enough of the document to decode")
         return newdata
 
-    def _detectEncoding(self, xml_data):
-        """Given a document, tries to detect its XML encoding."""
-        xml_encoding = sniffed_xml_encoding = None
+    def _detectEncoding(self, xml_data, isHTML=False):
+        """Given a document, tries to detect its XML encoding and, if
+        isHTML is true, the charset of its META tag. Only the start of
+        the document is looked at, and only that is transcoded to
+        find the declarations in."""
+        xml_encoding = sniffed_xml_encoding = html_encoding = None
+        sample = xml_data[:self.SNIFF_SIZE]
         try:
-            if xml_data[:4] == '\x4c\x6f\xa7\x94':
+            if sample[:4] == '\x4c\x6f\xa7\x94':
                 # EBCDIC
                 xml_data = self._ebcdic_to_ascii(xml_data)
-            elif xml_data[:4] == '\x00\x3c\x00\x3f':
+                sample = xml_data[:self.SNIFF_SIZE]
+            elif sample[:4] == '\x00\x3c\x00\x3f':
                 # UTF-16BE
                 sniffed_xml_encoding = 'utf-16be'
-                xml_data = unicode(xml_data, 'utf-16be').encode('utf-8')
-            elif (len(xml_data) >= 4) and (xml_data[:2] == '\xfe\xff') \
-                     and (xml_data[2:4] != '\x00\x00'):
+                sample = unicode(sample, 'utf-16be', 'ignore').encode('utf-8')
+            elif (len(sample) >= 4) and (sample[:2] == '\xfe\xff') \
+                     and (sample[2:4] != '\x00\x00'):
                 # UTF-16BE with BOM
                 sniffed_xml_encoding = 'utf-16be'
-                xml_data = unicode(xml_data[2:], 'utf-16be').encode('utf-8')
-            elif xml_data[:4] == '\x3c\x00\x3f\x00':
+                sample = unicode(sample[2:], 'utf-16be', 'ignore').encode('utf-8')
+            elif sample[:4] == '\x3c\x00\x3f\x00':
                 # UTF-16LE
                 sniffed_xml_encoding = 'utf-16le'
-                xml_data = unicode(xml_data, 'utf-16le').encode('utf-8')
-            elif (len(xml_data) >= 4) and (xml_data[:2] == '\xff\xfe') and \
-                     (xml_data[2:4] != '\x00\x00'):
+                sample = unicode(sample, 'utf-16le', 'ignore').encode('utf-8')
+            elif (len(sample) >= 4) and (sample[:2] == '\xff\xfe') and \
+                     (sample[2:4] != '\x00\x00'):
                 # UTF-16LE with BOM
                 sniffed_xml_encoding = 'utf-16le'
-                xml_data = unicode(xml_data[2:], 'utf-16le').encode('utf-8')
-            elif xml_data[:4] == '\x00\x00\x00\x3c':
+                sample = unicode(sample[2:], 'utf-16le', 'ignore').encode('utf-8')
+            elif sample[:4] == '\x00\x00\x00\x3c':
                 # UTF-32BE
                 sniffed_xml_encoding = 'utf-32be'
-                xml_data = unicode(xml_data, 'utf-32be').encode('utf-8')
-            elif xml_data[:4] == '\x3c\x00\x00\x00':
+                sample = unicode(sample, 'utf-32be', 'ignore').encode('utf-8')
+            elif sample[:4] == '\x3c\x00\x00\x00':
                 # UTF-32LE
                 sniffed_xml_encoding = 'utf-32le'
-                xml_data = unicode(xml_data, 'utf-32le').encode('utf-8')
-            elif xml_data[:4] == '\x00\x00\xfe\xff':
+                sample = unicode(sample, 'utf-32le', 'ignore').encode('utf-8')
+            elif sample[:4] == '\x00\x00\xfe\xff':
                 # UTF-32BE with BOM
                 sniffed_xml_encoding = 'utf-32be'
-                xml_data = unicode(xml_data[4:], 'utf-32be').encode('utf-8')
-            elif xml_data[:4] == '\xff\xfe\x00\x00':
+                sample = unicode(sample[4:], 'utf-32be', 'ignore').encode('utf-8')
+            elif sample[:4] == '\xff\xfe\x00\x00':
                 # UTF-32LE with BOM
                 sniffed_xml_encoding = 'utf-32le'
-                xml_data = unicode(xml_data[4:], 'utf-32le').encode('utf-8')
-            elif xml_data[:3] == '\xef\xbb\xbf':
+                sample = unicode(sample[4:], 'utf-32le', 'ignore').encode('utf-8')
+            elif sample[:3] == '\xef\xbb\xbf':
                 # UTF-8 with BOM
                 sniffed_xml_encoding = 'utf-8'
-                xml_data = unicode(xml_data[3:], 'utf-8').encode('utf-8')
+                sample = sample[3:]
             else:
                 sniffed_xml_encoding = 'ascii'
                 pass
-            xml_encoding_match = re.compile \
-                                 ('^<\?.*encoding=[\'"](.*?)[\'"].*\?>')\
-                                 .match(xml_data)
+            xml_encoding_match = self.XML_ENCODING_RE.match(sample)
         except:
             xml_encoding_match = None
         if xml_encoding_match:
@@ -1843,8 +2282,22 @@ class UnicodeDammit:
                                  'utf-16', 'utf-32', 'utf_16', 'utf_32',
                                  'utf16', 'u16')):
                 xml_encoding = sniffed_xml_encoding
-        return xml_data, xml_encoding, sniffed_xml_encoding
-
+        if isHTML:
+            html_encoding = self._detectHTMLEncoding(sample)
+        return xml_data, xml_encoding, sniffed_xml_encoding, html_encoding
+
+    def _detectHTMLEncoding(self, html_data):
+        """Finds the charset of the first META tag that has one, the
+        same way BeautifulSoup.start_meta does."""
+        for tag in self.META_TAG_RE.findall(html_data):
+            attrs = {}
+            for key, dq, sq, value in self.META_ATTRIBUTE_RE.findall(tag):
+                attrs[key.lower()] = dq or sq or value
+            if attrs.get('http-equiv') and attrs.get('content'):
+                match = BeautifulSoup.CHARSET_RE.search(attrs['content'])
+                if match and match.group(3):
+                    return match.group(3)
+        return None
 
     def find_codec(self, charset):
         return self._codec(self.CHARSET_ALIASES.get(charset, charset)) \
@@ -1920,6 +2373,7 @@ class UnicodeDammit:
                  '\x9d' : '?',
                  '\x9e' : ('#x17E', '17E'),
                  '\x9f' : ('Yuml', ''),}
+    MS_CHAR_BYTES = ''.join(MS_CHARS.keys())
 
 #######################################################################
 
@@ -159,17 +159,18 @@ SUPPORTED_VERSIONS = {'': 'unknown',
                       }
 
 try:
-    UserDict = dict
+    dict
 except NameError:
     # Python 2.1 does not have dict
-    from UserDict import UserDict
     def dict(aList):
         rc = {}
         for k, v in aList:
             rc[k] = v
         return rc
 
-class FeedParserDict(UserDict):
+_notfound = object()
+
+class FeedParserDict(dict):
     keymap = {'channel': 'feed',
               'items': 'entries',
               'guid': 'id',
@@ -185,33 +186,49 @@ class FeedParserDict(UserDict):
               'copyright_detail': 'rights_detail',
               'tagline': 'subtitle',
               'tagline_detail': 'subtitle_detail'}
-    def __getitem__(self, key):
+
+    # keymap worked out once: the key each alias is stored under, and the
+    # keys to try in turn when an alias isn't stored itself
+    _storekeys = {}
+    _readkeys = {}
+    for _key, _realkey in keymap.items():
+        if type(_realkey) == types.ListType:
+            _storekeys[_key] = _realkey[0]
+            _readkeys[_key] = tuple(_realkey)
+        else:
+            _storekeys[_key] = _realkey
+            _readkeys[_key] = (_realkey,)
+    del _key, _realkey
+
+    def _lookup(self, key, default):
+        """Value of a key that isn't stored under its own name, or default"""
+        for realkey in self._readkeys.get(key, ()):
+            if dict.__contains__(self, realkey):
+                return dict.__getitem__(self, realkey)
         if key == 'category':
-            return UserDict.__getitem__(self, 'tags')[0]['term']
-        if key == 'categories':
-            return [(tag['scheme'], tag['term']) for tag in UserDict.__getitem__(self, 'tags')]
-        realkey = self.keymap.get(key, key)
-        if type(realkey) == types.ListType:
-            for k in realkey:
-                if UserDict.has_key(self, k):
-                    return UserDict.__getitem__(self, k)
-        if UserDict.has_key(self, key):
-            return UserDict.__getitem__(self, key)
-        return UserDict.__getitem__(self, realkey)
+            tags = dict.get(self, 'tags')
+            if tags:
+                return tags[0]['term']
+        elif key == 'categories':
+            tags = dict.get(self, 'tags')
+            if tags is not None:
+                return [(tag['scheme'], tag['term']) for tag in tags]
+        return default
+
+    def __missing__(self, key):
+        value = self._lookup(key, _notfound)
+        if value is _notfound:
+            raise KeyError, key
+        return value
 
     def __setitem__(self, key, value):
-        for k in self.keymap.keys():
-            if key == k:
-                key = self.keymap[k]
-                if type(key) == types.ListType:
-                    key = key[0]
-        return UserDict.__setitem__(self, key, value)
+        return dict.__setitem__(self, self._storekeys.get(key, key), value)
 
     def get(self, key, default=None):
-        if self.has_key(key):
-            return self[key]
-        else:
-            return default
+        value = dict.get(self, key, _notfound)
+        if value is _notfound:
+            return self._lookup(key, default)
+        return value
 
     def setdefault(self, key, value):
         if not self.has_key(key):
@@ -219,21 +236,17 @@ class FeedParserDict(UserDict):
         return self[key]
         
     def has_key(self, key):
-        try:
-            return hasattr(self, key) or UserDict.has_key(self, key)
-        except AttributeError:
-            return False
+        return dict.__contains__(self, key) or self._lookup(key, _notfound) is not _notfound
         
     def __getattr__(self, key):
-        try:
-            return self.__dict__[key]
-        except KeyError:
-            pass
-        try:
-            assert not key.startswith('_')
-            return self.__getitem__(key)
-        except:
-            raise AttributeError, "object has no attribute '%s'" % key
+        # Only reached once normal attribute lookup has failed
+        if not key.startswith('_'):
+            value = dict.get(self, key, _notfound)
+            if value is _notfound:
+                value = self._lookup(key, _notfound)
+            if value is not _notfound:
+                return value
+        raise AttributeError, "object has no attribute '%s'" % key
 
     def __setattr__(self, key, value):
         if key.startswith('_') or key == 'data':
@@ -241,8 +254,7 @@ class FeedParserDict(UserDict):
         else:
             return self.__setitem__(key, value)
 
-    def __contains__(self, key):
-        return self.has_key(key)
+    __contains__ = has_key
 
 def zopeCompatibilityHack():
     global FeedParserDict
@@ -438,6 +438,14 @@ def open_for_read_by_name(name,mode='b'):
         if 'b' not in mode and os.linesep!='\n': s = s.replace(os.linesep,'\n')
         return getStringIO(s)
 
+_urlCache = None
+def setURLCache(cache):
+    '''install an object whose read(url) method returns the data for a URL;
+    open_for_read will then use it instead of fetching URLs itself.
+    Use None to go back to fetching directly'''
+    global _urlCache
+    _urlCache = cache
+
 import urllib
 def open_for_read(name,mode='b', urlopen=urllib.urlopen):
     '''attempt to open a file or URL for reading'''
@@ -446,6 +454,8 @@ def open_for_read(name,mode='b', urlopen=urllib.urlopen):
         return open_for_read_by_name(name,mode)
     except:
         try:
+            if _urlCache is not None:
+                return getStringIO(_urlCache.read(name))
             return getStringIO(urlopen(name).read())
         except:
             raise IOError('Cannot open resource "%s"' % name)
@@ -660,6 +670,28 @@ class ImageReader(object):
         width, height = self.getSize()
         return width, height, self.getRGBData()
 
+    def resample(self, width, height, jpegQuality=85):
+        '''return an ImageReader for this image scaled down to at most width x height
+        pixels, or self if it's no bigger than that already. JPEGs are re-encoded as
+        JPEG so they can still be embedded without decompressing'''
+        iw, ih = self.getSize()
+        width = max(1,min(iw,int(width+0.5)))
+        height = max(1,min(ih,int(height+0.5)))
+        if (width,height)==(iw,ih) or not haveImages or sys.platform[0:4]=='java':
+            return self
+        import PIL.Image
+        im = self._image
+        isJPEG = getattr(im,'format',None)=='JPEG' and im.mode in ('L','RGB','CMYK')
+        if im.mode not in ('L','RGB','RGBA','CMYK'):
+            im = im.convert('RGBA')
+        im = im.resize((width,height),PIL.Image.ANTIALIAS)
+        if isJPEG:
+            f = getStringIO()
+            im.save(f,'JPEG',quality=jpegQuality)
+            f.seek(0)
+            return ImageReader(f)
+        return ImageReader(im)
+
     def getTransparent(self):
         if sys.platform[0:4] == 'java':
             return None
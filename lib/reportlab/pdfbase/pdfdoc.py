@@ -58,6 +58,8 @@ __InternalName__ = "__InternalName__"
 
 # __RefOnly__ marks reference only elements that must be formatted on top level
 __RefOnly__ = "__RefOnly__"
+# __Stream__ marks elements that format as streams, which can't go in object streams
+__Stream__ = "__Stream__"
 
 # __Comment__ provides a (one line) comment to inline with an object ref, if present
 #   if it is more than one line then percentize it...
@@ -141,7 +143,10 @@ class PDFDocument:
                  dummyoutline=0,
                  compression=rl_config.pageCompression,
                  invariant=rl_config.invariant,
-                 filename=None):
+                 filename=None,
+                 compressionLevel=None,
+                 compressionThreads=None,
+                 objectStreams=None):
 
         # allow None value to be passed in to mean 'give system defaults'
         if invariant is None:
@@ -149,6 +154,14 @@ class PDFDocument:
         else:
             self.invariant = invariant
         self.setCompression(compression)
+        if compressionLevel is None: compressionLevel = rl_config.compressionLevel
+        if compressionThreads is None: compressionThreads = rl_config.compressionThreads
+        self.compressionLevel = compressionLevel
+        self.compressionThreads = compressionThreads
+        if objectStreams is None: objectStreams = rl_config.objectStreams
+        self.objectStreams = objectStreams
+        # data -> compressed data for streams done ahead of formatting
+        self._zcache = {}
         # signature for creating PDF ID
         import md5
         sig = self.signature = md5.new()
@@ -190,6 +203,65 @@ class PDFDocument:
         # XXX: maybe this should also set self.defaultStreamFilters?
         self.compression = onoff
 
+    def zcompress(self, data):
+        "zlib compress stream data, using the result from precompressStreams if there is one"
+        r = self._zcache.pop(id(data),None)
+        if r is not None and r[0] is data: return r[1]
+        zlib = import_zlib()
+        if not zlib: raise ImportError, "cannot z-compress zlib unavailable"
+        return zlib.compress(data, self.compressionLevel)
+
+    # streams smaller than this aren't worth handing to another thread
+    precompressThreshold = 16384
+    # how many streams each thread compresses ahead of formatting
+    precompressBatch = 4
+
+    def _precompressData(self, obj):
+        "the data of obj's stream if it's big enough to be compressed by precompressStreams"
+        data = None
+        if isinstance(obj,(PDFPage,PDFFormXObject)):
+            if obj.compression and not obj.Contents: data = obj.stream
+        elif isinstance(obj,PDFStream):
+            filters = obj.filters
+            if filters is None: filters = self.defaultStreamFilters
+            if filters and isinstance(filters[-1],PDFStreamFilterZCompress) and not obj.dictionary.dict.has_key("Filter"):
+                data = obj.content
+        elif isinstance(obj,PDFImageXObject):
+            data = getattr(obj,'_raw',None)
+        if type(data) is types.StringType and len(data)>=self.precompressThreshold:
+            return data
+
+    def precompressStreams(self, ids=None, threads=None):
+        """compress the data of the large streams among the objects with the given
+        ids (default all of them) using a pool of threads (zlib releases the GIL
+        while it works); zcompress hands each result over and forgets it"""
+        if threads is None: threads = self.compressionThreads
+        zlib = import_zlib()
+        if not zlib or threads<1: return
+        if ids is None: ids = self.idToObject.keys()
+        pending = []
+        for name in ids:
+            data = self._precompressData(self.idToObject[name])
+            if data is not None and id(data) not in self._zcache:
+                self._zcache[id(data)] = None
+                pending.append(data)
+        if not pending: return
+        import threading, Queue
+        queue = Queue.Queue()
+        for data in pending: queue.put(data)
+        level = self.compressionLevel
+        zcache = self._zcache
+        def work():
+            while 1:
+                try:
+                    data = queue.get_nowait()
+                except Queue.Empty:
+                    return
+                zcache[id(data)] = (data, zlib.compress(data, level))
+        workers = [threading.Thread(target=work) for i in xrange(min(threads,len(pending)))]
+        for w in workers: w.start()
+        for w in workers: w.join()
+
     def updateSignature(self, thing):
         "add information to the signature"
         if self._ID: return # but not if its used already!
@@ -216,7 +288,8 @@ class PDFDocument:
             myfile = 1
             filename = utf8str(filename)
             f = open(filename, "wb")
-        f.write(self.GetPDFData(canvas))
+        # write objects out as they're formatted rather than building the whole file in memory
+        self.GetPDFData(canvas, f)
         if myfile:
             f.close()
             import os
@@ -225,7 +298,9 @@ class PDFDocument:
                 markfilename(filename) # do platform specific file junk
         if getattr(canvas,'_verbosity',None): print 'saved', filename
 
-    def GetPDFData(self, canvas):
+    def GetPDFData(self, canvas, f=None):
+        """return the document as a string, or if f is given write it to f
+        as it is formatted and return None"""
         # realize delayed fonts
         for fnt in self.delayedFonts:
             fnt.addObjects(self)
@@ -238,7 +313,7 @@ class PDFDocument:
         self.Reference(self.info)
         outline = self.outline
         outline.prepare(self, canvas)
-        return self.format()
+        return self.format(f)
 
     def inPage(self):
         """specify the current object as a page (enables reference binding and other page features)"""
@@ -348,9 +423,10 @@ class PDFDocument:
         fontnames.sort()
         return fontnames
 
-    def format(self):
+    def format(self, f=None):
         # register the Catalog/INfo and then format the objects one by one until exhausted
         # (possible infinite loop if there is a bug that continually makes new objects/refs...)
+        # if f is given each object is written to it as soon as it's formatted
         # Prepare encryption
         self.encrypt.prepare(self)
         cat = self.Catalog
@@ -362,6 +438,9 @@ class PDFDocument:
         encryptinfo = self.encrypt.info()
         if encryptinfo:
             encryptref = self.Reference(encryptinfo)
+        # object streams can't be used with encryption as their contents aren't encrypted per object
+        objectStreams = self.objectStreams and not encryptinfo
+        packed = [] # (id, formatted object) to go into object streams
         # make std fonts (this could be made optional
         counter = 0 # start at first object (object 1 after preincrement)
         ids = [] # the collection of object ids in object number order
@@ -371,16 +450,33 @@ class PDFDocument:
         idToOf = self.idToOffset
         ### note that new entries may be "appended" DURING FORMATTING
         done = None
-        File = PDFFile() # output collector
+        File = PDFFile(f, objectStreams and PDFHeader15 or PDFHeader) # output collector
+        # large streams in output order, compressed in parallel a batch at a time
+        # just before they're formatted so only one batch is ever held at once
+        zpending = []
+        if self.compressionThreads:
+            numbers = numbertoid.keys()
+            numbers.sort()
+            zpending = [numbertoid[n] for n in numbers if self._precompressData(idToOb[numbertoid[n]]) is not None]
         while done is None:
             counter += 1 # do next object...
             if numbertoid.has_key(counter):
                 id = numbertoid[counter]
                 #printidToOb
                 obj = idToOb[id]
+                if zpending and zpending[0]==id:
+                    self._zcache.clear()
+                    batch = self.compressionThreads*self.precompressBatch
+                    self.precompressStreams(zpending[:batch])
+                    del zpending[:batch]
                 IO = PDFIndirectObject(id, obj)
                 # register object number and version
                 #encrypt.register(id,
+                if objectStreams and not getattr(obj, __Stream__, 0):
+                    # not a stream so it can be packed
+                    packed.append((id, IO.formatContent(self)))
+                    ids.append(id)
+                    continue
                 IOf = IO.format(self)
                 # add a comment to the PDF output
                 if not rl_config.invariant and DoComments:
@@ -398,6 +494,11 @@ class PDFDocument:
         lno = len(numbertoid)
         if counter-1!=lno:
             raise ValueError, "counter %s doesn't match number to id dictionary %s" %(counter, lno)
+        if objectStreams:
+            self._formatObjectStreams(File, ids, packed)
+            if f is None:
+                return File.format(self)
+            return
         # now add the xref
         xref = PDFCrossReferenceTable()
         xref.addsection(0, ids)
@@ -414,8 +515,70 @@ class PDFDocument:
             )
         trailerf = trailer.format(self)
         File.add(trailerf)
-        # return string format for pdf file
-        return File.format(self)
+        if f is None:
+            # return string format for pdf file
+            return File.format(self)
+
+    # the most objects to put in one object stream
+    objectStreamSize = 100
+
+    def _formatObjectStreams(self, File, ids, packed):
+        """finish a PDF 1.5 file by writing the packed objects in compressed
+        object streams followed by a cross-reference stream and trailer"""
+        import struct
+        idToNV = self.idToObjectNumberAndVersion
+        idToOf = self.idToOffset
+        xref = {} # object number -> (type, field 2, field 3)
+        for id in ids:
+            if idToOf.has_key(id):
+                n, v = idToNV[id]
+                xref[n] = (1, idToOf[id], v)
+        for start in xrange(0, len(packed), self.objectStreamSize):
+            chunk = packed[start:start+self.objectStreamSize]
+            S = PDFStream()
+            S.filters = [PDFZCompress]
+            S.__Comment__ = "object stream"
+            stmid = self.Reference(S).name
+            stmnum = idToNV[stmid][0]
+            header = []
+            body = []
+            offset = 0
+            for i in xrange(len(chunk)):
+                id, fcontent = chunk[i]
+                n = idToNV[id][0]
+                header.append("%s %s" % (n, offset))
+                body.append(fcontent+LINEEND)
+                offset += len(fcontent)+len(LINEEND)
+                xref[n] = (2, stmnum, i)
+            header = string.join(header, " ")+LINEEND
+            S.content = header+string.join(body, "")
+            S.dictionary["Type"] = PDFName("ObjStm")
+            S.dictionary["N"] = len(chunk)
+            S.dictionary["First"] = len(header)
+            IOf = PDFIndirectObject(stmid, S).format(self)
+            idToOf[stmid] = File.add(IOf)
+            xref[stmnum] = (1, idToOf[stmid], 0)
+        # the cross-reference stream lists itself too
+        X = PDFStream()
+        X.filters = [PDFZCompress]
+        X.__Comment__ = "cross-reference stream"
+        xid = self.Reference(X).name
+        xnum = idToNV[xid][0]
+        xrefoffset = File.offset
+        xref[xnum] = (1, xrefoffset, 0)
+        entries = [struct.pack(">BLH", 0, 0, 65535)]
+        for n in xrange(1, xnum+1):
+            entries.append(struct.pack(">BLH", *xref[n]))
+        X.content = string.join(entries, "")
+        D = X.dictionary
+        D["Type"] = PDFName("XRef")
+        D["Size"] = xnum+1
+        D["W"] = PDFArray([1, 4, 2])
+        D["Root"] = self.Reference(self.Catalog)
+        D["Info"] = self.Reference(self.info)
+        D["ID"] = self.ID()
+        File.add(PDFIndirectObject(xid, X).format(self))
+        File.add(XREFSTREAMTRAILERFMT % {"startxref": xrefoffset, "LINEEND": LINEEND, "PERCENT": "%"})
 
     def hasForm(self, name):
         """test for existence of named form"""
@@ -724,10 +887,13 @@ STREAMFMT = ("%(dictionary)s%(LINEEND)s" # dictionary
              "%(content)s" # the content, with no lineend
              "endstream%(LINEEND)s" # the endstream keyword
              )
+# outermost filters that leave the content as text which can't run into endstream
+_textStreamFilters = ('/ASCII85Decode','/ASCIIHexDecode','/A85','/AHx')
 class PDFStream:
     '''set dictionary elements explicitly stream.dictionary[name]=value'''
     ### compression stuff not implemented yet
     __RefOnly__ = 1 # must be at top level
+    __Stream__ = 1
     def __init__(self, dictionary=None, content=None):
         if dictionary is None:
             dictionary = PDFDictionary()
@@ -753,7 +919,10 @@ class PDFStream:
             for f in rf:
                 #print "*****************content:"; print repr(content[:200])
                 #print "*****************filter", f.pdfname
-                content = f.encode(content)
+                if isinstance(f,PDFStreamFilterZCompress) and hasattr(document,'zcompress'):
+                    content = document.zcompress(content)
+                else:
+                    content = f.encode(content)
                 fnames.insert(0, PDFName(f.pdfname))
             #print "*****************finally:"; print content[:200]
             #print "****** FILTERS", fnames
@@ -764,6 +933,11 @@ class PDFStream:
         fc = format(content, document)
         #print "type(content)", type(content), len(content), type(self.dictionary)
         lc = len(content)
+        F = dictionary.dict.get("Filter")
+        if isinstance(F,PDFArray): F = F.sequence and F.sequence[0]
+        if F and F not in _textStreamFilters:
+            # binary content gets an end of line, not counted in the length, before endstream
+            fc = fc+LINEEND
         #if fc!=content: burp
         # set dictionary length parameter
         dictionary["Length"] = lc
@@ -819,13 +993,15 @@ class PDFIndirectObject:
     def __init__(self, name, content):
         self.name = name
         self.content = content
-    def format(self, document):
-        name = self.name
-        (n, v) = document.idToObjectNumberAndVersion[name]
+    def formatContent(self, document):
+        "format the object itself, without the obj/endobj wrapper"
+        (n, v) = document.idToObjectNumberAndVersion[self.name]
         # set encryption parameters
         document.encrypt.register(n, v)
-        content = self.content
-        fcontent = format(content, document, toplevel=1) # yes this is at top level
+        return format(self.content, document, toplevel=1) # yes this is at top level
+    def format(self, document):
+        (n, v) = document.idToObjectNumberAndVersion[self.name]
+        fcontent = self.formatContent(document)
         sdict = LINEENDDICT.copy()
         sdict["n"] = n
         sdict["v"] = v
@@ -851,13 +1027,19 @@ PDFHeader = (
 "%PDF-1.3"+LINEEND+
 "%\223\214\213\236 ReportLab Generated PDF document http://www.reportlab.com"+LINEEND)
 
+PDFHeader15 = PDFHeader.replace("%PDF-1.3", "%PDF-1.5", 1) # object and cross-reference streams
+
 class PDFFile:
     ### just accumulates strings: keeps track of current offset
-    def __init__(self):
+    ### or, given a file, writes them straight out to it
+    def __init__(self, f=None, header=PDFHeader):
         self.strings = []
-        self.write = self.strings.append
+        if f is None:
+            self.write = self.strings.append
+        else:
+            self.write = f.write
         self.offset = 0
-        self.add(PDFHeader)
+        self.add(header)
 
     def closeOrReset(self):
         pass
@@ -940,6 +1122,11 @@ TRAILERFMT = ("trailer%(LINEEND)s"
               "%(startxref)s%(LINEEND)s"
               "%(PERCENT)s%(PERCENT)sEOF%(LINEEND)s")
 
+# with a cross-reference stream the trailer dictionary is the stream's dictionary
+XREFSTREAMTRAILERFMT = ("startxref%(LINEEND)s"
+              "%(startxref)s%(LINEEND)s"
+              "%(PERCENT)s%(PERCENT)sEOF%(LINEEND)s")
+
 class PDFTrailer:
 
     def __init__(self, startxref, Size=None, Prev=None, Root=None, Info=None, ID=None, Encrypt=None):
@@ -1888,6 +2075,7 @@ class PDFFormXObject:
     #   the form!! (not implemented yet).
     XObjects = Annots = BBox = Matrix = Contents = stream = Resources = None
     hasImages = 1 # probably should change
+    __Stream__ = 1
     compression = 0
     def __init__(self, lowerx, lowery, upperx, uppery):
         #not done
@@ -1947,6 +2135,7 @@ class PDFFormXObject:
 
 class PDFPostScriptXObject:
     "For embedding PD (e.g. tray commands) in PDF"
+    __Stream__ = 1
     def __init__(self, content=None):
         self.content = content
 
@@ -1966,7 +2155,8 @@ class PDFImageXObject:
     # have a PDFStream object with 3 attributes:  dictionary, content
     # and filters.  So the job of this thing is to construct the
     # right PDFStream instance and ask it to format itself.
-    def __init__(self, name, source=None, mask=None):
+    __Stream__ = 1
+    def __init__(self, name, source=None, mask=None, document=None):
         self.name = name
         self.width = 24
         self.height = 23
@@ -1984,7 +2174,7 @@ class PDFImageXObject:
         if source is None:
             pass # use the canned one.
         elif hasattr(source,'jpeg_fh'):
-            self.loadImageFromSRC(source)   #it is already a PIL Image
+            self.loadImageFromSRC(source, document)   #it is already a PIL Image
         else:
             # it is a filename
             import os
@@ -2022,16 +2212,20 @@ class PDFImageXObject:
         else: #maybe should generate an error, is this right for CMYK?
             self.colorSpace = 'DeviceCMYK'
             self._dotrans = 1
-        self.streamContent = pdfutils._AsciiBase85Encode(imageFile.read())
-        self._filters = 'ASCII85Decode','DCTDecode' #'A85','DCT'
+        if rl_config.useA85:
+            self.streamContent = pdfutils._AsciiBase85Encode(imageFile.read())
+            self._filters = 'ASCII85Decode','DCTDecode' #'A85','DCT'
+        else:
+            self.streamContent = imageFile.read()
+            self._filters = 'DCTDecode', #'DCT'
         self.mask = None
         return True
 
-    def _checkTransparency(self,im):
+    def _checkTransparency(self,im,document=None):
         if self.mask=='auto':
             if im._dataA:
                 self.mask = None
-                self._smask = PDFImageXObject(_digester(im._dataA.getRGBData()),im._dataA,mask=None)
+                self._smask = PDFImageXObject(_digester(im._dataA.getRGBData()),im._dataA,mask=None,document=document)
                 self._smask._decode = [0,1]
             else:
                 tc = im.getTransparent()
@@ -2043,8 +2237,9 @@ class PDFImageXObject:
             _ = self.mask.rgb()
             self.mask = _[0],_[0],_[1],_[1],_[2],_[2]
 
-    def loadImageFromSRC(self, im):
-        "Extracts the stream, width and height"
+    def loadImageFromSRC(self, im, document=None):
+        """Extracts the stream, width and height; if document compresses in
+        threads, the pixels are kept and compressed when formatted"""
         fp = im.jpeg_fh()
         if fp:
             self.loadImageFromJPEG(fp)
@@ -2054,13 +2249,34 @@ class PDFImageXObject:
             self.width, self.height = im.getSize()
             raw = im.getRGBData()
             assert(len(raw) == self.width*self.height, "Wrong amount of data for image")
-            self.streamContent = pdfutils._AsciiBase85Encode(zlib.compress(raw))
+            if rl_config.useA85:
+                self._filters = 'ASCII85Decode','FlateDecode' #'A85','Fl'
+            else:
+                self._filters = 'FlateDecode', #'Fl'
+            if getattr(document,'compressionThreads',0):
+                # compressed when formatted so the document can do it in parallel
+                self._raw = raw
+                self.streamContent = None
+            else:
+                self.streamContent = self._encodeRaw(raw, document)
             self.colorSpace= _mode2CS[im.mode]
             self.bitsPerComponent = 8
-            self._filters = 'ASCII85Decode','FlateDecode' #'A85','Fl'
-            self._checkTransparency(im)
+            self._checkTransparency(im, document)
+
+    def _encodeRaw(self, raw, document=None):
+        "compress raw pixel data, then ASCII85 encode it if the filters call for it"
+        if document is None:
+            content = import_zlib().compress(raw)
+        else:
+            content = document.zcompress(raw)
+        if self._filters[0]=='ASCII85Decode':
+            content = pdfutils._AsciiBase85Encode(content)
+        return content
 
     def format(self, document):
+        if self.streamContent is None:
+            self.streamContent = self._encodeRaw(self._raw, document)
+            del self._raw
         S = PDFStream()
         S.content = self.streamContent
         dict = S.dictionary
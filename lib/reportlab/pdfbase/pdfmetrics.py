@@ -25,6 +25,7 @@ from reportlab.pdfbase import _fontdata
 from reportlab.lib.logger import warnOnce
 from reportlab.lib.utils import rl_isfile, rl_glob, rl_isdir, open_and_read, open_and_readlines
 from reportlab.rl_config import defaultEncoding
+from reportlab import rl_config
 import rl_codecs
 
 rl_codecs.RL_Codecs.register()
@@ -391,6 +392,29 @@ class Font:
                     else:
                         pass
         self.widths = w
+        self._uwidths = None
+        self._widthMemo = {}
+        self._oldWidthMemo = {}
+
+    def _calcUnicodeWidths(self):
+        """Vector of widths indexed by unicode code point.
+
+        Characters the encoding can't represent are None so the fast path in
+        _memoStringWidth gives up on them and falls back to _py_stringWidth,
+        which knows about substitution fonts."""
+        enc = self.encName
+        U = {}
+        for i in range(256):
+            try:
+                u = chr(i).decode(enc)
+            except (UnicodeDecodeError, LookupError):
+                continue
+            if len(u)==1 and u.encode(enc)==chr(i): U[ord(u)] = self.widths[i]
+        uw = [None]*(U and max(U.keys())+1 or 0)
+        for c, width in U.items():
+            uw[c] = width
+        self._uwidths = uw
+        return uw
 
     def _py_stringWidth(self, text, size, encoding='utf8'):
         """This is the "purist" approach to width.  The practical approach
@@ -398,7 +422,36 @@ class Font:
         written in C."""
         if not isinstance(text,unicode): text = text.decode(encoding)
         return sum([sum(map(f.widths.__getitem__,map(ord,t))) for f, t in unicode2T1(text,[self]+self.substitutionFonts)])*0.001*size
-    stringWidth = _py_stringWidth
+
+    def _memoStringWidth(self, text, size, encoding='utf8'):
+        """Same result as _py_stringWidth, but looks characters up directly in
+        a unicode indexed width vector and remembers the (size independent)
+        widths of recently seen strings.  The memo is kept as two generations;
+        when the new one fills up the old one is dropped, so strings that keep
+        being used survive."""
+        if not isinstance(text,unicode): text = text.decode(encoding)
+        memo = self._widthMemo
+        try:
+            return memo[text]*0.001*size
+        except KeyError:
+            pass
+        try:
+            w = self._oldWidthMemo[text]
+        except KeyError:
+            uw = self._uwidths
+            if uw is None: uw = self._calcUnicodeWidths()
+            try:
+                w = sum(map(uw.__getitem__,map(ord,text)))
+            except (TypeError, IndexError):
+                w = self._py_stringWidth(text,1000)
+        n = rl_config.stringWidthCacheSize
+        if n:
+            if len(memo)>=n:
+                self._oldWidthMemo = memo
+                self._widthMemo = memo = {}
+            memo[text] = w
+        return w*0.001*size
+    stringWidth = _memoStringWidth
 
     def _formatWidths(self):
         "returns a pretty block in PDF Array format to aid inspection"
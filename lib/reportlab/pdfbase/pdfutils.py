@@ -7,6 +7,9 @@ __doc__=''
 # compression, and some constants
 
 import os
+import struct
+import binascii
+from array import array
 from reportlab import rl_config
 from reportlab.lib.utils import getStringIO, ImageReader
 
@@ -169,11 +172,7 @@ def _AsciiHexEncode(input):
     This is a verbose encoding used for binary data within
     a PDF file.  One byte binary becomes two bytes of ASCII.
     Helper function used by images."""
-    output = getStringIO()
-    for char in input:
-        output.write('%02x' % ord(char))
-    output.write('>')
-    return output.getvalue()
+    return binascii.hexlify(input) + '>'
 
 
 def _AsciiHexDecode(input):
@@ -187,7 +186,7 @@ def _AsciiHexDecode(input):
     stripped = stripped[:-1]  #chop off terminator
     assert len(stripped) % 2 == 0, 'Ascii Hex stream has odd number of bytes'
 
-    return ''.join([chr(int(stripped[i:i+2],16)) for i in xrange(0,len(stripped),2)])
+    return binascii.unhexlify(stripped)
         
 if 1: # for testing always define this
     def _AsciiBase85EncodePYTHON(input):
@@ -336,13 +335,93 @@ if 1: # for testing always define this
         #terminator code for ascii 85
         return ''.join(out.__self__)
 
+    # Block versions of the above. Whole four byte words are converted together
+    # and only the short group at the end goes through the per-byte code.
+    _A85PAIRS = [chr(i+33)+chr(j+33) for i in xrange(85) for j in xrange(85)]
+    _A85CHARS = [chr(i+33) for i in xrange(85)]
+    _A85OFFSET = 33*(85**4+85**3+85**2+85+1)
+
+    def _AsciiBase85EncodeSTRUCT(input):
+        """Encodes input using ASCII-Base85 coding, a word at a time."""
+        whole_word_count = len(input)//4
+        cut = 4 * whole_word_count
+        P = _A85PAIRS
+        C = _A85CHARS
+        out = []
+        append = out.append
+        for num in struct.unpack('>%dL' % whole_word_count, input[:cut]):
+            if num:
+                num, c45 = divmod(num, 7225)
+                c12, c3 = divmod(num, 85)
+                append(P[c12]+C[c3]+P[c45])
+            else:
+                append('z')
+        append(_AsciiBase85EncodePYTHON(input[cut:]))
+        return ''.join(out)
+
+    def _AsciiBase85DecodeSTRUCT(input):
+        """Decodes input using ASCII-Base85 coding, a word at a time."""
+        stripped = ''.join(input.split())
+        assert stripped[-2:] == '~>', 'Invalid terminator for Ascii Base 85 Stream'
+        stripped = stripped[:-2].replace('z','!!!!!')
+        whole_word_count = len(stripped)//5
+        cut = 5 * whole_word_count
+        b = array('B', stripped[:cut])
+        o = _A85OFFSET
+        nums = [((((b[i]*85+b[i+1])*85+b[i+2])*85+b[i+3])*85+b[i+4])-o for i in xrange(0,cut,5)]
+        return struct.pack('>%dL' % whole_word_count, *nums) + _AsciiBase85DecodePYTHON(stripped[cut:]+'~>')
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+if numpy:
+    def _AsciiBase85EncodeNUMPY(input):
+        """Encodes input using ASCII-Base85 coding with NumPy arrays."""
+        whole_word_count = len(input)//4
+        cut = 4 * whole_word_count
+        num = numpy.frombuffer(input[:cut], dtype='>u4').astype(numpy.uint64)
+        digits = numpy.empty((whole_word_count, 5), dtype=numpy.uint8)
+        for i in (4,3,2,1,0):
+            digits[:,i] = num % 85 + 33
+            num //= 85
+        body = digits.tostring()
+        zero = numpy.frombuffer(input[:cut], dtype='>u4')==0
+        if zero.any():
+            # whole zero words become a single 'z'
+            digits[zero,0] = ord('z')
+            keep = numpy.ones(digits.shape, dtype=bool)
+            keep[zero,1:] = False
+            body = digits[keep].tostring()
+        return body + _AsciiBase85EncodePYTHON(input[cut:])
+
+    def _AsciiBase85DecodeNUMPY(input):
+        """Decodes input using ASCII-Base85 coding with NumPy arrays."""
+        stripped = ''.join(input.split())
+        assert stripped[-2:] == '~>', 'Invalid terminator for Ascii Base 85 Stream'
+        stripped = stripped[:-2].replace('z','!!!!!')
+        whole_word_count = len(stripped)//5
+        cut = 5 * whole_word_count
+        digits = numpy.frombuffer(stripped[:cut], dtype=numpy.uint8).reshape((whole_word_count, 5))
+        num = numpy.zeros(whole_word_count, dtype=numpy.uint64)
+        for i in xrange(5):
+            num *= 85
+            num += digits[:,i] - 33
+        return num.astype('>u4').tostring() + _AsciiBase85DecodePYTHON(stripped[cut:]+'~>')
+    _AsciiBase85EncodeFAST = _AsciiBase85EncodeNUMPY
+    _AsciiBase85DecodeFAST = _AsciiBase85DecodeNUMPY
+else:
+    _AsciiBase85EncodeFAST = _AsciiBase85EncodeSTRUCT
+    _AsciiBase85DecodeFAST = _AsciiBase85DecodeSTRUCT
+
 try:
     from _rl_accel import _AsciiBase85Encode                    # builtin or on the path
 except ImportError:
     try:
         from reportlab.lib._rl_accel import _AsciiBase85Encode  # where we think it should be
     except ImportError:
-        _AsciiBase85Encode = _AsciiBase85EncodePYTHON
+        _AsciiBase85Encode = _AsciiBase85EncodeFAST
 
 try:
     from _rl_accel import _AsciiBase85Decode                    # builtin or on the path
@@ -350,7 +429,7 @@ except ImportError:
     try:
         from reportlab.lib._rl_accel import _AsciiBase85Decode  # where we think it should be
     except ImportError:
-        _AsciiBase85Decode = _AsciiBase85DecodePYTHON
+        _AsciiBase85Decode = _AsciiBase85DecodeFAST
 
 def _wrap(input, columns=60):
     "Wraps input at a given column size by inserting LINEEND characters."
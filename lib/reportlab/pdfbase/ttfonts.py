@@ -401,15 +401,89 @@ class TTFontMaker:
 class TTFontFile(TTFontParser):
     "TTF file parser and generator"
 
+    # everything extractInfo sets, so it can be kept in rl_config.ttfMetricsCache
+    _infoAttrs = ('name', 'familyName', 'styleName', 'fullName', 'uniqueFontID',
+                'fontRevision', 'unitsPerEm', 'bbox', 'ascent', 'descent',
+                'capHeight', 'italicAngle', 'stemV', 'underlinePosition',
+                'underlineThickness', 'flags', 'charToGlyph', 'defaultWidth',
+                'charWidths', 'hmetrics', 'glyphPos')
+    _infoVersion = 1    # bump if extractInfo changes what it produces
+
     def __init__(self, file, charInfo=1, validate=0,subfontIndex=0):
         """Loads and parses a TrueType font file.
 
         file can be a filename or a file object.  If validate is set to a false
         values, skips checksum validation.  This can save time, especially if
         the font is large.  See TTFontFile.extractInfo for more information.
+
+        If rl_config.ttfMetricsCache names a directory the extracted
+        information is saved there and reused by later runs for as long as
+        the font file is unchanged.
         """
         TTFontParser.__init__(self, file, validate=validate,subfontIndex=subfontIndex)
-        self.extractInfo(charInfo)
+        from reportlab import rl_config
+        cacheDir = rl_config.ttfMetricsCache
+        if not cacheDir:
+            self.extractInfo(charInfo)
+            return
+        key = self._infoCacheKey(charInfo, subfontIndex)
+        if not self._loadInfo(cacheDir, key):
+            self.extractInfo(charInfo)
+            self._saveInfo(cacheDir, key)
+
+    def _infoCacheKey(self, charInfo, subfontIndex):
+        "identify the font by path, modification time and a checksum of its data"
+        import os, zlib
+        try:
+            fn = os.path.abspath(self.filename)
+            mtime = os.path.getmtime(fn)
+        except OSError:
+            fn = self.filename
+            mtime = None
+        return repr((self._infoVersion, fn, mtime, len(self._ttf_data),
+                    zlib.crc32(self._ttf_data), subfontIndex, not not charInfo))
+
+    def _infoCacheFile(self, cacheDir, key):
+        import os, md5
+        return os.path.join(cacheDir, md5.new(key).hexdigest()+'.ttfinfo')
+
+    def _loadInfo(self, cacheDir, key):
+        "set the extracted attributes from the cache; returns false if they aren't there"
+        import marshal
+        try:
+            f = open(self._infoCacheFile(cacheDir, key), 'rb')
+            try:
+                D = marshal.load(f)
+            finally:
+                f.close()
+        except (IOError, EOFError, ValueError, TypeError):
+            return 0
+        if not isinstance(D, dict) or D.get('key')!=key:
+            return 0
+        for k in self._infoAttrs:
+            setattr(self, k, D[k])
+        return 1
+
+    def _saveInfo(self, cacheDir, key):
+        "write the extracted attributes to the cache, ignoring any failure"
+        import os, marshal
+        D = {'key': key}
+        for k in self._infoAttrs:
+            D[k] = getattr(self, k, None)
+        fn = self._infoCacheFile(cacheDir, key)
+        tfn = '%s.%d.tmp' % (fn, os.getpid())
+        try:
+            if not os.path.isdir(cacheDir):
+                os.makedirs(cacheDir)
+            f = open(tfn, 'wb')
+            try:
+                marshal.dump(D, f)
+            finally:
+                f.close()
+            if os.path.exists(fn): os.remove(fn)
+            os.rename(tfn, fn)
+        except (IOError, OSError):
+            pass
 
     def extractInfo(self, charInfo=1):
         """Extract typographic information from the loaded font file.
@@ -123,20 +123,39 @@ class Canvas(textobject._PDFColorSetter):
                  bottomup = 1,
                  pageCompression=None,
                  invariant = None,
-                 verbosity=0):
+                 verbosity=0,
+                 imageDPI=None,
+                 compressionLevel=None,
+                 compressionThreads=None,
+                 objectStreams=None):
         """Create a canvas of a given size. etc.
 
         You may pass a file-like object to filename as an alternative to
         a string.
+
+        If imageDPI is non-zero, images are resampled down to that resolution
+        at the size they're drawn before being embedded (see drawImage).
+
+        compressionLevel sets the zlib level for compressed streams and, if
+        compressionThreads is non-zero, large page, image and font streams are
+        compressed in that many threads just before the document is written.
+
+        If objectStreams is set a PDF 1.5 file is written, with everything but
+        streams packed into compressed object streams and a cross-reference
+        stream in place of the xref table.
         
         Most of the attributes are private - we will use set/get methods
         as the preferred interface.  Default page size is A4."""
         if pagesize is None: pagesize = rl_config.defaultPageSize
         if invariant is None: invariant = rl_config.invariant
+        if imageDPI is None: imageDPI = rl_config.imageDPI
         self._filename = filename
 
         self._doc = pdfdoc.PDFDocument(compression=pageCompression,
-                                       invariant=invariant, filename=filename)
+                                       invariant=invariant, filename=filename,
+                                       compressionLevel=compressionLevel,
+                                       compressionThreads=compressionThreads,
+                                       objectStreams=objectStreams)
 
 
         #this only controls whether it prints 'saved ...' - 0 disables
@@ -171,6 +190,7 @@ class Canvas(textobject._PDFColorSetter):
         #drawing coordinates.
         self.bottomup = bottomup
         self.imageCaching = rl_config.defaultImageCaching
+        self._imageDPI = imageDPI
         self.init_graphics_state()
         self._make_preamble()
         self.state_stack = []
@@ -563,7 +583,7 @@ class Canvas(textobject._PDFColorSetter):
         img_obj.drawInlineImage(self,anchor=anchor,preserveAspectRatio=preserveAspectRatio)
         return (img_obj.width, img_obj.height)
 
-    def drawImage(self, image, x, y, width=None, height=None, mask=None, preserveAspectRatio=False, anchor='sw'):
+    def drawImage(self, image, x, y, width=None, height=None, mask=None, preserveAspectRatio=False, anchor='sw', dpi=None):
         """Draws the image (ImageReader object or filename) as specified.
 
         "image" may be an image filename or an ImageReader object.  If width
@@ -596,13 +616,28 @@ class Canvas(textobject._PDFColorSetter):
         objects, it tests whether the image content has changed before deciding
         whether to reuse it.
 
+        If dpi (or the canvas's imageDPI) is set and width and height are given,
+        images with more pixels than needed at that resolution are resampled
+        down to the drawn size before being embedded, and the returned width
+        and height are those of the resampled image.
+
         In general you should use drawImage in preference to drawInlineImage
         unless you have read the PDF Spec and understand the tradeoffs."""
         self._currentPageHasImages = 1
 
+        if dpi is None: dpi = self._imageDPI
+        resample = dpi and width is not None and height is not None
+        if resample:
+            if not isinstance(image,(str,unicode)):
+                #only a filename or URL identifies it cheaply, so resample now and digest the result
+                image = self._resampleImage(image,width,height,dpi,preserveAspectRatio)
+                resample = False
+
         # first, generate a unique name/signature for the image.  If ANYTHING
         # is different, even the mask, this should be different.
-        if isinstance(image,ImageReader):
+        if resample:
+            name = _digester('%s%s%s' % (image, mask, (width, height, dpi, preserveAspectRatio)))
+        elif isinstance(image,ImageReader):
             rawdata = image.getRGBData()
             smask = image._dataA
             if mask=='auto' and smask:
@@ -620,7 +655,9 @@ class Canvas(textobject._PDFColorSetter):
         imgObj = self._doc.idToObject.get(regName, None)
         if not imgObj:
             #first time seen, create and register the PDFImageXobject
-            imgObj = pdfdoc.PDFImageXObject(name, image, mask=mask)
+            if resample:
+                image = self._resampleImage(image,width,height,dpi,preserveAspectRatio)
+            imgObj = pdfdoc.PDFImageXObject(name, image, mask=mask, document=self._doc)
             imgObj.name = name
             self._setXObjects(imgObj)
             self._doc.Reference(imgObj, regName)
@@ -652,6 +689,18 @@ class Canvas(textobject._PDFColorSetter):
 
         return (imgObj.width, imgObj.height)
 
+    def _resampleImage(self, image, width, height, dpi, preserveAspectRatio=False):
+        "return an ImageReader with no more pixels than needed to draw image at dpi"
+        if not isinstance(image,ImageReader):
+            image = ImageReader(image)
+        sw = width*dpi/72.
+        sh = height*dpi/72.
+        if preserveAspectRatio:
+            iw, ih = image.getSize()
+            scale = min(sw/iw,sh/ih)
+            sw, sh = iw*scale, ih*scale
+        return image.resample(sw,sh)
+
     def _restartAccumulators(self):
         if self._codeStack:
             # restore the saved code
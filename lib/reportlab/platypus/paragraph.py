@@ -10,12 +10,13 @@ from reportlab.platypus.paraparser import ParaParser
 from reportlab.platypus.flowables import Flowable
 from reportlab.lib.colors import Color
 from reportlab.lib.enums import TA_LEFT, TA_RIGHT, TA_CENTER, TA_JUSTIFY
-from reportlab.lib.utils import _className
+from reportlab.lib.utils import _className, ImageReader
 from reportlab.lib.textsplit import wordSplit, ALL_CANNOT_START
 from copy import deepcopy
 from reportlab.lib.abag import ABag
 from reportlab.rl_config import platypus_link_underline 
-import re
+from reportlab import rl_config
+import re, new
 
 #on UTF8 branch, split and strip must be unicode-safe!
 def split(text, delim=None):
@@ -52,6 +53,50 @@ class FragLine(ABag):
 # XXXXX if the parser has any internal state using only one is probably a BAD idea!
 _parser=ParaParser()
 
+#parsed frags for recently seen (text, style) pairs, kept in two generations;
+#when the new one reaches rl_config.paraFragCacheSize the old one is dropped
+_fragCache = {}
+_oldFragCache = {}
+_re_seq = re.compile('<seq',re.I)
+
+def _copyFrags(frags,instance=new.instance):
+    "copies of frags (and their cbDefns) that can be changed without affecting the originals"
+    if not frags: return frags
+    R = []
+    for f in frags:
+        d = f.__dict__.copy()
+        if 'cbDefn' in d:
+            c = d['cbDefn']
+            d['cbDefn'] = instance(c.__class__,c.__dict__.copy())
+        R.append(instance(f.__class__,d))
+    return R
+
+def _parseFrags(text,style,caseSensitive):
+    """parse text with style returning (style, frags, bulletTextFrags), reusing
+    an earlier parse of the same text with the same unchanged style if there
+    is one.  Text with <seq> tags is always parsed as each parse advances the
+    sequence."""
+    global _fragCache, _oldFragCache
+    size = rl_config.paraFragCacheSize
+    if not size or _re_seq.search(text):
+        _parser.caseSensitive = caseSensitive
+        return _parser.parse(text,style)
+    key = type(text), text, caseSensitive, id(style)
+    entry = _fragCache.get(key) or _oldFragCache.get(key)
+    if entry is None or entry[0] is not style or entry[1]!=style.__dict__:
+        _parser.caseSensitive = caseSensitive
+        pstyle, frags, bulletTextFrags = _parser.parse(text,style)
+        if frags is None: return pstyle, frags, bulletTextFrags
+        #keep our own copies; the caller may change what it's given
+        entry = style, style.__dict__.copy(), pstyle, _copyFrags(frags), _copyFrags(bulletTextFrags)
+    else:
+        pstyle, frags, bulletTextFrags = entry[2], _copyFrags(entry[3]), _copyFrags(entry[4])
+    if len(_fragCache)>=size:
+        _oldFragCache = _fragCache
+        _fragCache = {}
+    _fragCache[key] = entry
+    return pstyle, frags, bulletTextFrags
+
 def _lineClean(L):
     return join(filter(truth,split(strip(L))))
 
@@ -171,6 +216,8 @@ def _putFragLine(cur_x, tx, line):
                     txfs = xs.style.fontSize
                 iy0,iy1 = imgVRange(h,cbDefn.valign,txfs)
                 cur_x_s = cur_x + nSpaces*ws
+                if cbDefn.image is None:
+                    cbDefn.image = ImageReader(cbDefn.src)
                 tx._canvas.drawImage(cbDefn.image,cur_x_s,cur_y+iy0,w,h,mask='auto')
                 cur_x += w
                 cur_x_s += w
@@ -432,6 +479,87 @@ def _handleBulletWidth(bulletText,style,maxWidths):
             #..then it overruns, and we have less space available on line 1
             maxWidths[0] -= (bulletRight - indent)
 
+_tfShrink = 1./3        #justified spaces may shrink by this much
+_tfStretch = 0.5        #and stretch this much before a line counts as loose
+_tfRaggedStretch = 2    #ems of slack allowed for unjustified lines
+_tfLinePenalty = 10
+def _totalFitBreaks(widths,spaces,forced,maxWidths,justify,em):
+    '''return the set of word indexes that should start new lines
+
+    widths[i] is the width of word i, spaces[i] the space before it and
+    forced[i] true if a line must end after it. The first line is maxWidths[0]
+    wide and the rest maxWidths[-1]. Each run between forced breaks is set in
+    as few lines as it will go, and of those settings the one with the least
+    sum of squared line demerits is chosen (Knuth & Plass's total fit) rather
+    than filling each line in turn. Only the few line ends that keep the line
+    count down are tried from each start, so the cost is linear in the number
+    of words.
+    '''
+    n = len(widths)
+    #running totals give any line's natural width and glue in constant time
+    W = [0]
+    G = [0]
+    for i in xrange(n):
+        W.append(W[-1]+widths[i])
+        G.append(G[-1]+(widths[i]>0 and spaces[i] or 0))
+    shrinkFactor = justify and _tfShrink or 0
+    far = [0]*(n+1)     #far[j] is the furthest a line starting at word j can end
+    lines = [0]*(n+1)   #lines[j] is the fewest lines words j.. of the run need
+    best = [None]*(n+1) #best[k] is the least demerits for words s..k-1 and the start of their last line
+    breaks = set()
+    s = 0
+    while s<n:
+        e = s
+        while e<n-1 and not forced[e]: e += 1
+        e += 1
+        k = s+1
+        for j in xrange(s,e):
+            if j: maxWidth = maxWidths[-1]
+            else: maxWidth = maxWidths[0]
+            if k<=j: k = j+1
+            while k<e:
+                glue = G[k+1]-G[j+1]
+                shrink = k+1<e and glue*shrinkFactor or 0
+                if W[k+1]-W[j]+glue-shrink>maxWidth: break
+                k += 1
+            far[j] = k
+        lines[e] = 0
+        for j in xrange(e-1,s-1,-1):
+            lines[j] = lines[far[j]]+1
+        best[s] = 0, None
+        for j in xrange(s+1,e+1): best[j] = None
+        for j in xrange(s,e):
+            if best[j] is None: continue
+            d0 = best[j][0]
+            need = lines[j]-1
+            if j: maxWidth = maxWidths[-1]
+            else: maxWidth = maxWidths[0]
+            k = far[j]
+            while k>j and lines[k]==need:
+                glue = G[k]-G[j+1]
+                slack = maxWidth-(W[k]-W[j]+glue)
+                last = k==e
+                shrink = not last and glue*shrinkFactor or 0
+                if slack < -shrink:
+                    b = 10000   #a single word that can't fit anywhere
+                elif slack<0:
+                    b = 100*(-slack/shrink)**3
+                elif last:
+                    b = 0
+                else:
+                    stretch = justify and glue*_tfStretch or em*_tfRaggedStretch
+                    b = stretch and min(100*(slack/stretch)**3,10000) or 10000
+                d = d0+(_tfLinePenalty+b)**2
+                if best[k] is None or d<best[k][0]:
+                    best[k] = d, j
+                k -= 1
+        k = e
+        while k!=s:
+            k = best[k][1]
+            if k!=s: breaks.add(k)
+        s = e
+    return breaks
+
 def splitLines0(frags,widths):
     '''
     given a list of ParaFrags we return a list of ParaLines
@@ -770,8 +898,7 @@ class Paragraph(Flowable):
     def _setup(self, text, style, bulletText, frags, cleaner):
         if frags is None:
             text = cleaner(text)
-            _parser.caseSensitive = self.caseSensitive
-            style, frags, bulletTextFrags = _parser.parse(text,style)
+            style, frags, bulletTextFrags = _parseFrags(text,style,self.caseSensitive)
             if frags is None:
                 raise ValueError("xml parser error (%s) in paragraph beginning\n'%s'"\
                     % (_parser.errors[0],text[:min(30,len(text))]))
@@ -792,14 +919,29 @@ class Paragraph(Flowable):
         leftIndent = style.leftIndent
         first_line_width = availWidth - (leftIndent+style.firstLineIndent) - style.rightIndent
         later_widths = availWidth - leftIndent - style.rightIndent
+        autoLeading = getattr(self,'autoLeading',getattr(style,'autoLeading',''))
 
-        if style.wordWrap == 'CJK':
-            #use Asian text wrap algorithm to break characters
-            blPara = self.breakLinesCJK([first_line_width, later_widths])
-        else:
-            blPara = self.breakLines([first_line_width, later_widths])
+        #the lines only depend on the widths as long as the content and style
+        #are unchanged, so remember the result for each
+        cache = self.__dict__.get('_blParaCache')
+        if cache is None or cache[0] is not self.frags or cache[1] is not self.bulletText \
+                or cache[2] is not style or cache[3]!=style.__dict__:
+            cache = self._blParaCache = self.frags, self.bulletText, style, style.__dict__.copy(), {}
+        key = first_line_width, later_widths, style.wordWrap, autoLeading, getattr(self,'encoding',None)
+        try:
+            blPara, self.width = cache[4][key]
+        except KeyError:
+            if style.wordWrap == 'CJK':
+                #use Asian text wrap algorithm to break characters
+                blPara = self.breakLinesCJK([first_line_width, later_widths])
+            elif style.wordWrap == 'TOTALFIT':
+                #choose the breaks for the whole paragraph at once
+                blPara = self.breakLinesTotalFit([first_line_width, later_widths])
+            else:
+                blPara = self.breakLines([first_line_width, later_widths])
+            if len(cache[4])>=8: cache[4].clear()
+            cache[4][key] = blPara, self.width
         self.blPara = blPara
-        autoLeading = getattr(self,'autoLeading',getattr(style,'autoLeading',''))
         leading = style.leading
         if blPara.kind==1 and autoLeading not in ('','off'):
             height = 0
@@ -894,6 +1036,7 @@ class Paragraph(Flowable):
                     del self.blPara #no room for adjustment; force the whole para onwards
                     return []
         func = self._get_split_blParaFunc()
+        self._blParaCache = None    #splitting can change the words of blPara's lines
 
         P1=self.__class__(None,style,bulletText=self.bulletText,frags=func(blPara,0,s))
         #this is a major hack
@@ -914,7 +1057,26 @@ class Paragraph(Flowable):
         #so not doing it here makes it easier to switch.
         self.drawPara(self.debug)
 
-    def breakLines(self, width):
+    def _simpleWords(self, f):
+        "(word, width) pairs for the single frag f; worked out once for each frags list"
+        c = self.__dict__.get('_simpleWordsCache')
+        if c is None or c[0] is not self.frags or c[1] is not f:
+            fontName = f.fontName
+            fontSize = f.fontSize
+            encoding = self.encoding
+            words = hasattr(f,'text') and split(f.text, ' ') or f.words
+            #this underscores my feeling that Unicode throughout would be easier!
+            c = self._simpleWordsCache = self.frags, f, [(w, stringWidth(w, fontName, fontSize, encoding)) for w in words]
+        return c[2]
+
+    def _fragWords(self):
+        "_getFragWords(self.frags) with its word widths; worked out once for each frags list"
+        c = self.__dict__.get('_fragWordsCache')
+        if c is None or c[0] is not self.frags:
+            c = self._fragWordsCache = self.frags, _getFragWords(self.frags)
+        return c[1]
+
+    def breakLines(self, width, breaks=None):
         """
         Returns a broken line structure. There are two cases
 
@@ -941,7 +1103,10 @@ class Paragraph(Flowable):
         You can supply either a single width or a list of widths; the latter will have its
         last item repeated until necessary. A 2-element list is useful when there is a
         different first line indent; a longer list could be created to facilitate custom wraps
-        around irregular objects."""
+        around irregular objects.
+
+        If breaks is given it is a set of word indexes that start new lines, used instead of
+        filling each line as far as it will go (see breakLinesTotalFit)."""
 
         if not isinstance(width,(tuple,list)): maxWidths = [width]
         else: maxWidths = width
@@ -964,15 +1129,16 @@ class Paragraph(Flowable):
             fontSize = f.fontSize
             fontName = f.fontName
             ascent, descent = getAscentDescent(fontName,fontSize)
-            words = hasattr(f,'text') and split(f.text, ' ') or f.words
             spaceWidth = stringWidth(' ', fontName, fontSize, self.encoding)
             cLine = []
             currentWidth = -spaceWidth   # hack to get around extra space for word 1
-            for word in words:
-                #this underscores my feeling that Unicode throughout would be easier!
-                wordWidth = stringWidth(word, fontName, fontSize, self.encoding)
+            for wordNo, (word, wordWidth) in enumerate(self._simpleWords(f)):
                 newWidth = currentWidth + spaceWidth + wordWidth
-                if newWidth <= maxWidth or not len(cLine):
+                if breaks is None:
+                    fits = newWidth <= maxWidth
+                else:
+                    fits = wordNo not in breaks
+                if fits or not len(cLine):
                     # fit one more on this line
                     cLine.append(word)
                     currentWidth = newWidth
@@ -1005,7 +1171,7 @@ class Paragraph(Flowable):
                 return self.blPara
             n = 0
             words = []
-            for w in _getFragWords(frags):
+            for wordNo, w in enumerate(self._fragWords()):
                 f=w[-1][0]
                 fontName = f.fontName
                 fontSize = f.fontSize
@@ -1026,7 +1192,13 @@ class Paragraph(Flowable):
                 #test to see if this frag is a line break. If it is we will only act on it
                 #if the current width is non-negative or the previous thing was a deliberate lineBreak
                 lineBreak = hasattr(f,'lineBreak')
-                endLine = (newWidth>maxWidth and n>0) or lineBreak
+                if breaks is None:
+                    endLine = newWidth>maxWidth and n>0
+                else:
+                    #n doesn't count words starting with an empty frag, but a chosen
+                    #break always has at least one word before it on the line
+                    endLine = wordNo in breaks and len(words)>0
+                endLine = endLine or lineBreak
                 if not endLine:
                     if lineBreak: continue      #throw it away
                     nText = w[1][1]
@@ -1153,6 +1325,38 @@ class Paragraph(Flowable):
 
         return lines
 
+    def breakLinesTotalFit(self, width):
+        """Like breakLines, but the breaks are chosen for the paragraph as a whole
+        so that its lines are as evenly filled as possible. Justified lines may
+        have their spaces squeezed a little, which often saves a line.
+        Selected with style.wordWrap='TOTALFIT'."""
+        if not isinstance(width,(tuple,list)): maxWidths = [width]
+        else: maxWidths = list(width)
+        style = self.style
+        _handleBulletWidth(self.bulletText,style,maxWidths)
+        frags = self.frags
+        if len(frags)==1 and not hasattr(frags[0],'cbDefn'):
+            f = frags[0]
+            spaceWidth = stringWidth(' ', f.fontName, f.fontSize, self.encoding)
+            widths = [w[1] for w in self._simpleWords(f)]
+            spaces = [spaceWidth]*len(widths)
+            forced = [0]*len(widths)
+            em = f.fontSize
+        elif frags and not (hasattr(self,'blPara') and getattr(self,'_splitpara',0)):
+            widths = []
+            spaces = []
+            forced = []
+            for w in self._fragWords():
+                f = w[-1][0]
+                widths.append(w[0])
+                spaces.append(stringWidth(' ',f.fontName,f.fontSize))
+                forced.append(hasattr(w[1][0],'lineBreak'))
+            em = style.fontSize
+        else:
+            return self.breakLines(width)
+        breaks = _totalFitBreaks(widths,spaces,forced,maxWidths,style.alignment==TA_JUSTIFY,em)
+        return self.breakLines(width,breaks)
+
     def breakLinesCJK(self, width):
         """Initially, the dumbest possible wrapping algorithm.
         Cannot handle font variations."""
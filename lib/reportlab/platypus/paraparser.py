@@ -8,18 +8,28 @@ from types import TupleType, UnicodeType, StringType
 import sys
 import os
 import copy
+import new
 import unicodedata
 import reportlab.lib.sequencer
 from reportlab.lib.abag import ABag
 from reportlab.lib.utils import ImageReader
 
 from reportlab.lib import xmllib
+try:
+    from xml.parsers import expat
+except ImportError:
+    expat = None
 
 from reportlab.lib.colors import toColor, white, black, red, Color
 from reportlab.lib.fonts import tt2ps, ps2tt
 from reportlab.lib.enums import TA_LEFT, TA_RIGHT, TA_CENTER, TA_JUSTIFY
 from reportlab.lib.units import inch,mm,cm,pica
 _re_para = re.compile(r'^\s*<\s*para(?:\s+|>|/>)')
+#markup whose xmllib handling expat can't reproduce, or must only be parsed once
+_re_noexpat = re.compile(r'<[!?]|<seq|[\r\n\t]',re.I)
+#a complete start tag and any reference in it that isn't a predefined entity
+_re_starttag = re.compile(r'''<(?:[^>"']|"[^"]*"|'[^']*')*>''')
+_re_attrref = re.compile(r'&(?!(?:amp|lt|gt|quot|apos);)')
 
 sizeDelta = 2       # amount to reduce font size by for super and sub script
 subFraction = 0.5   # fraction of font size that a sub script should be lowered
@@ -337,6 +347,10 @@ class ParaFrag(ABag):
     fontname, fontSize, rise, textColor, cbDefn
     """
 
+def _copyFrag(frag,instance=new.instance):
+    "shallow copy of a frag, several times quicker than copy.copy"
+    return instance(frag.__class__,frag.__dict__.copy())
+
 
 _greek2Utf8=None
 def _greekConvert(data):
@@ -395,6 +409,9 @@ def _greekConvert(data):
 #
 # It will also be able to handle any MathML specified Greek characters.
 #------------------------------------------------------------------
+class _ExpatFallback(Exception):
+    "raised to abandon an expat parse in favour of xmllib"
+
 class ParaParser(xmllib.XMLParser):
 
     #----------------------------------------------------------
@@ -515,10 +532,16 @@ class ParaParser(xmllib.XMLParser):
         defn = frag.cbDefn = ABag()
         defn.kind = 'img'
         defn.src = getattr(frag,'src',None)
-        defn.image = ImageReader(defn.src)
-        size = defn.image.getSize()
-        defn.width = getattr(frag,'width',size[0])
-        defn.height = getattr(frag,'height',size[1])
+        if hasattr(frag,'width') and hasattr(frag,'height'):
+            #size is given so don't touch the image until it's drawn
+            defn.image = None
+            defn.width = frag.width
+            defn.height = frag.height
+        else:
+            defn.image = ImageReader(defn.src)
+            size = defn.image.getSize()
+            defn.width = getattr(frag,'width',size[0])
+            defn.height = getattr(frag,'height',size[1])
         defn.valign = getattr(frag,'valign','bottom')
         del frag._selfClosingTag
         self.handle_data('')
@@ -761,7 +784,7 @@ class ParaParser(xmllib.XMLParser):
 
     #---------------------------------------------------------------
     def _push(self,**attr):
-        frag = copy.copy(self._stack[-1])
+        frag = _copyFrag(self._stack[-1])
         _applyAttributes(frag,attr)
         self._stack.append(frag)
 
@@ -790,6 +813,9 @@ class ParaParser(xmllib.XMLParser):
 
     #----------------------------------------------------------------
 
+    # parse well formed markup with expat when it's available
+    useExpat = expat is not None
+
     def __init__(self,verbose=0):
         self.caseSensitive = 0
         xmllib.XMLParser.__init__(self,verbose=verbose)
@@ -811,7 +837,7 @@ class ParaParser(xmllib.XMLParser):
     def handle_data(self,data):
         "Creates an intermediate representation of string segments."
 
-        frag = copy.copy(self._stack[-1])
+        frag = _copyFrag(self._stack[-1])
         if hasattr(frag,'cbDefn'):
             kind = frag.cbDefn.kind
             if data: self._syntax_error('Only empty <%s> tag allowed' % kind)
@@ -876,10 +902,71 @@ class ParaParser(xmllib.XMLParser):
         # given string
         if not(len(text)>=6 and text[0]=='<' and _re_para.match(text)):
             text = "<para>"+text+"</para>"
+        if self.useExpat and not _re_noexpat.search(text):
+            if self._expat_parse(text):
+                return self._complete_parse()
+            self._setup_for_parse(style)
         self.feed(text)
         self.close()    # force parsing to complete
         return self._complete_parse()
 
+    def _expat_parse(self, text):
+        """Drive the tag handlers from the C expat parser instead of xmllib.
+
+        The handlers see exactly the calls xmllib would make: text between
+        markup is delivered in one piece and every entity or character
+        reference on its own.  Returns false, leaving the parser to be reset,
+        if the text isn't well formed or uses anything the two handle
+        differently (comments, CDATA, raw whitespace, entities in attribute
+        values).  Text containing <seq> tags is never tried, as those can't
+        safely be run through twice.
+        """
+        P = expat.ParserCreate('utf-8')
+        P.returns_unicode = 0
+        P.UseForeignDTD(1) # so unknown entities are skipped rather than errors
+        P.SetParamEntityParsing(expat.XML_PARAM_ENTITY_PARSING_NEVER)
+        pending = []
+        handle_data = self.handle_data
+
+        def flush():
+            if pending:
+                handle_data(''.join(pending))
+                del pending[:]
+
+        def characters(data):
+            if text[P.CurrentByteIndex]=='&':
+                flush()
+                handle_data(data)
+            else:
+                pending.append(data)
+
+        def skipped(name, isParameter):
+            flush()
+            self.handle_entityref(name)
+
+        def start(tag, attrs):
+            flush()
+            if attrs:
+                i = P.CurrentByteIndex
+                tagText = _re_starttag.match(text, i)
+                if not tagText or _re_attrref.search(text, i, tagText.end()):
+                    raise _ExpatFallback
+            self.finish_starttag(tag, attrs)
+
+        def end(tag):
+            flush()
+            self.finish_endtag(tag)
+
+        P.CharacterDataHandler = characters
+        P.SkippedEntityHandler = skipped
+        P.StartElementHandler = start
+        P.EndElementHandler = end
+        try:
+            P.Parse(text, 1)
+        except (expat.ExpatError, _ExpatFallback):
+            return 0
+        return 1
+
     def _complete_parse(self):
         del self._seq
         style = self._style
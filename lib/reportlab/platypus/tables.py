@@ -229,6 +229,7 @@ class Table(Flowable):
             raise ValueError("%s invalid data type" % self.identity())
         self._nrows = nrows = len(data)
         self._cellvalues = []
+        self._cellGeomCache = {}    # (id(flowable), available width) -> (flowable, wrapped size)
         _seqCW = type(colWidths) in _SeqTypes
         _seqRH = type(rowHeights) in _SeqTypes
         if nrows: self._ncols = ncols = max(map(_rowLen,data))
@@ -363,7 +364,23 @@ class Table(Flowable):
 
         return "<%s at %d %d rows x %s cols>%s" % (self.__class__.__name__, id(self), nr, nc, vx)
 
-    def _listCellGeom(self, V,w,s,W=None,H=None,aH=72000):
+    def _wrapCell(self, v, canv, aW, aH, sizeOnly=0):
+        """v.wrapOn(canv, aW, aH), remembered in _cellGeomCache against v and aW.
+
+        With sizeOnly set a remembered size is returned without wrapping v;
+        otherwise v is really wrapped, as it must be before it's drawn.  The
+        available height is ignored for this; cells are sized with an
+        unbounded height and rows are never shorter than that.
+        """
+        key = id(v), aW
+        if sizeOnly:
+            c = self._cellGeomCache.get(key)
+            if c is not None and c[0] is v: return c[1]
+        size = v.wrapOn(canv, aW, aH)
+        self._cellGeomCache[key] = v, size
+        return size
+
+    def _listCellGeom(self, V,w,s,W=None,H=None,aH=72000,sizeOnly=0):
         if not V: return 0,0
         aW = w - s.leftPadding - s.rightPadding
         aH = aH - s.topPadding - s.bottomPadding
@@ -372,7 +389,7 @@ class Table(Flowable):
         canv = getattr(self,'canv',None)
         sb0 = None
         for v in V:
-            vw, vh = v.wrapOn(canv, aW, aH)
+            vw, vh = self._wrapCell(v, canv, aW, aH, sizeOnly)
             sb = v.getSpaceBefore()
             sa = v.getSpaceAfter()
             if W is not None: W.append(vw)
@@ -388,7 +405,7 @@ class Table(Flowable):
         t = 0
         w = 0
         canv = getattr(self,'canv',None)
-        return max([v.wrapOn(canv,aW,aH)[0] for v in V])
+        return max([self._wrapCell(v,canv,aW,aH,sizeOnly=1)[0] for v in V])
 
     def _calc_width(self,availWidth,W=None):
         if getattr(self,'_width_calculated_once',None): return
@@ -490,8 +507,8 @@ class Table(Flowable):
             saved = None
             #get a handy list of any cells which span rows. should be ignored for sizing
             if self._spanCmds:
-                rowSpanCells = self._rowSpanCells
-                colSpanCells = self._colSpanCells
+                rowSpanCells = set(self._rowSpanCells)
+                colSpanCells = set(self._colSpanCells)
                 spanRanges = self._spanRanges
                 colpositions = self._colpositions
             else:
@@ -503,11 +520,13 @@ class Table(Flowable):
             self._rowHeights = H
             spanCons = {}
             FUZZ = rl_config._FUZZ
-            while None in H:
-                i = H.index(None)
+            height = 0  #height of the rows before i
+            for i in xrange(lim):
+                if H[i] is not None:
+                    height += H[i]
+                    continue
                 if longTable:
                     hmax = i
-                    height = reduce(operator.add, H[:i], 0)
                     # we can stop if we have filled up all available room
                     if height > availHeight: break
                 V = self._cellvalues[i] # values for row i
@@ -528,7 +547,7 @@ class Table(Flowable):
                             if ji in colSpanCells:
                                 if not span: continue
                                 w = max(colpositions[span[2]+1]-colpositions[span[0]],w)
-                            dW,t = self._listCellGeom(v,w or self._listValueWidth(v),s)
+                            dW,t = self._listCellGeom(v,w or self._listValueWidth(v),s,sizeOnly=1)
                             if canv: canv._fontname, canv._fontsize, canv._leading = saved
                             dW = dW + s.leftPadding + s.rightPadding
                             if not rl_config.allowTableBoundsErrors and dW>w:
@@ -547,7 +566,9 @@ class Table(Flowable):
                                 t = 0
                     if t>h: h = t   #record a new maximum
                 H[i] = h
-            if None not in H: hmax = lim
+                height += h
+            else:
+                hmax = lim
 
             if spanCons:
                 spanFixDim(H0,H,spanCons)
@@ -1225,6 +1246,7 @@ class Table(Flowable):
             R1._cr_1_0(n,self._spanCmds)
             R1._cr_1_0(n,self._nosplitCmds)
 
+        R0._cellGeomCache = R1._cellGeomCache = self._cellGeomCache
         R0.hAlign = R1.hAlign = self.hAlign
         R0.vAlign = R1.vAlign = self.vAlign
         self.onSplit(R0)
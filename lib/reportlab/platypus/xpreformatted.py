@@ -191,6 +191,9 @@ class XPreformatted(Paragraph):
 
         return lines
 
+    #preformatted lines are never rebroken
+    breakLinesTotalFit = breakLines
+
     # we need this her to get the right splitter
     def _get_split_blParaFunc(self):
         return _split_blPara
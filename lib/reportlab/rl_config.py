@@ -37,6 +37,18 @@ imageReaderFlags=0                                  #attempt to convert images i
                                                     #if imageReaderFlags&2 then attempt autoclosing of those files
                                                     #if imageReaderFlags&4 then cache data 
                                                     #if imageReaderFlags==-1 then use Ralf Schmitt's re-opening approach
+paraFragCacheSize=1024                              #how many parsed paragraphs to keep for reuse (0 to disable)
+stringWidthCacheSize=2048                           #how many string widths each font remembers (0 to disable)
+ttfMetricsCache=''                                  #if set, a directory where TTFontFile keeps the metrics and
+                                                    #character maps it extracts so later runs needn't reparse them
+objectStreams=0                                     #if non-zero write PDF 1.5 files with objects packed into
+                                                    #compressed object streams and a cross-reference stream
+compressionLevel=6                                  #zlib level (1-9) used for compressed streams
+compressionThreads=0                                #if non-zero, compress large streams in this many threads before output
+useA85=1                                            #set to 0 to write image XObject data as raw binary
+                                                    #rather than ASCII85 encoding it (JPEGs are then embedded as is)
+imageDPI=0                                          #if non-zero the canvas resamples larger images down to this
+                                                    #resolution at their drawn size before embedding them
 
 # places to look for T1Font information
 T1SearchPath =  (
@@ -162,7 +174,15 @@ odbc_driver
 platypus_link_underline
 canvas_basefontname
 allowShortTableRows
-imageReaderFlags'''.split()
+imageReaderFlags
+paraFragCacheSize
+stringWidthCacheSize
+ttfMetricsCache
+objectStreams
+compressionLevel
+compressionThreads
+useA85
+imageDPI'''.split()
     import os, sys
     global sys_version, _unset_
     sys_version = sys.version.split()[0]        #strip off the other garbage
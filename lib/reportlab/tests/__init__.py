@@ -0,0 +1,6 @@
+"""Tests for the bundled reportlab's own changes
+
+Run them with lib on the path:
+
+    python -m unittest discover -s lib/reportlab/tests -t lib
+"""
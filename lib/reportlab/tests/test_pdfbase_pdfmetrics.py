@@ -0,0 +1,56 @@
+"""Tests for the memoized Font.stringWidth in reportlab.pdfbase.pdfmetrics"""
+import unittest
+
+from reportlab import rl_config
+from reportlab.pdfbase import pdfmetrics
+
+class MemoStringWidthTestCase(unittest.TestCase):
+    texts = [u'', u' ', u'Hello World', u'Union Chapel, Islington', u'caf\xe9 \xe0 la cr\xe8me',
+            u'\u2018quoted\u2019 \u2014 dashes \u2026', u'\u20ac100', u'\u0391\u03b2\u03b3 greek',
+            u'\u2022 bullet', u'tab\tand\nnewline']
+
+    def setUp(self):
+        self.cacheSize = rl_config.stringWidthCacheSize
+
+    def tearDown(self):
+        rl_config.stringWidthCacheSize = self.cacheSize
+
+    def check(self, font, texts, sizes=(1,10,12.5)):
+        for text in texts:
+            for size in sizes:
+                # twice, so the second answer comes from the memo
+                for i in (0,1):
+                    self.assertAlmostEquals(font._memoStringWidth(text,size), font._py_stringWidth(text,size), 8,
+                        '%s width of %r at %s' % (font.fontName,text,size))
+
+    def testStandardFonts(self):
+        for name in ('Helvetica','Times-Roman','Courier','Symbol','ZapfDingbats'):
+            self.check(pdfmetrics.getFont(name), self.texts)
+
+    def testEncodedBytes(self):
+        font = pdfmetrics.getFont('Helvetica')
+        for text in self.texts:
+            for encoding in ('utf8','cp1252'):
+                try:
+                    data = text.encode(encoding)
+                except UnicodeEncodeError:
+                    continue
+                self.assertAlmostEquals(font._memoStringWidth(data,10,encoding), font._py_stringWidth(text,10), 8)
+
+    def testGenerations(self):
+        """strings dropped from both generations of a small memo are still measured right"""
+        rl_config.stringWidthCacheSize = 3
+        font = pdfmetrics.getFont('Times-Roman')
+        texts = [u'word %d' % i for i in xrange(20)]
+        self.check(font, texts+texts)
+        self.assert_(len(font._widthMemo)<=3)
+
+    def testNoMemo(self):
+        rl_config.stringWidthCacheSize = 0
+        font = pdfmetrics.getFont('Courier')
+        font._widthMemo.clear()
+        self.check(font, self.texts)
+        self.assertEquals(font._widthMemo, {})
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+"""Tests for the ASCII85 and hex codecs in reportlab.pdfbase.pdfutils"""
+import random
+import unittest
+
+from reportlab.pdfbase import pdfutils
+
+def _codecs():
+    codecs = [('PYTHON',pdfutils._AsciiBase85EncodePYTHON,pdfutils._AsciiBase85DecodePYTHON),
+            ('STRUCT',pdfutils._AsciiBase85EncodeSTRUCT,pdfutils._AsciiBase85DecodeSTRUCT)]
+    if pdfutils.numpy:
+        codecs.append(('NUMPY',pdfutils._AsciiBase85EncodeNUMPY,pdfutils._AsciiBase85DecodeNUMPY))
+    codecs.append(('default',pdfutils._AsciiBase85Encode,pdfutils._AsciiBase85Decode))
+    return codecs
+
+class AsciiBase85TestCase(unittest.TestCase):
+    def setUp(self):
+        r = random.Random(85)
+        # random bytes, runs of zero words and every length of tail
+        self.samples = ['', '\000', '\000'*4, '\000'*9, 'z', '~>', '\377'*4]
+        for n in xrange(1,9):
+            self.samples.append(''.join([chr(r.randint(0,255)) for i in xrange(n)]))
+        self.samples.append(''.join([chr(r.randint(0,255)) for i in xrange(4096)]) + '\000'*4096 + 'xyz')
+
+    def testEncodersAgree(self):
+        for data in self.samples:
+            expected = pdfutils._AsciiBase85EncodePYTHON(data)
+            for name, encode, decode in _codecs():
+                self.assertEquals(encode(data), expected, '%s encoder disagrees with PYTHON on %r' % (name,data[:16]))
+
+    def testRoundTrip(self):
+        for data in self.samples:
+            for name, encode, decode in _codecs():
+                self.assertEquals(decode(encode(data)), data, '%s round trip failed on %r' % (name,data[:16]))
+
+class AsciiHexTestCase(unittest.TestCase):
+    def testRoundTrip(self):
+        data = ''.join(map(chr,range(256)))*3
+        encoded = pdfutils._AsciiHexEncode(data)
+        self.assert_(encoded.endswith('>'))
+        self.assertEquals(pdfutils._AsciiHexDecode(encoded), data)
+        # whitespace and lower case are allowed when decoding
+        self.assertEquals(pdfutils._AsciiHexDecode('6 162\n63>'), 'abc')
+
+if __name__=='__main__':
+    unittest.main()
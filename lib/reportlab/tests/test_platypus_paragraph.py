@@ -0,0 +1,240 @@
+"""Tests for the parsed frag cache, line breaking memo and total-fit line
+breaking in reportlab.platypus.paragraph"""
+import random
+import unittest
+from copy import deepcopy
+from cStringIO import StringIO
+
+from reportlab import rl_config
+from reportlab.lib.enums import TA_JUSTIFY
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.pdfgen.canvas import Canvas
+from reportlab.platypus import paragraph
+from reportlab.platypus.paragraph import Paragraph
+from reportlab.platypus.xpreformatted import XPreformatted
+
+TEXT = 'a <b>bold</b> word, an <img src="x.png" width="10" height="12"/> image and <a href="#x" color="red">a link</a>'
+
+def _fragDicts(frags):
+    R = []
+    for f in frags:
+        D = f.__dict__.copy()
+        if 'cbDefn' in D: D['cbDefn'] = D['cbDefn'].__dict__.copy()
+        R.append(D)
+    return R
+
+class FragCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cacheSize = rl_config.paraFragCacheSize
+        rl_config.paraFragCacheSize = 1024
+        self.style = deepcopy(getSampleStyleSheet()['BodyText'])
+
+    def tearDown(self):
+        rl_config.paraFragCacheSize = self.cacheSize
+
+    def uncached(self, text, style):
+        rl_config.paraFragCacheSize = 0
+        try:
+            return Paragraph(text, style)
+        finally:
+            rl_config.paraFragCacheSize = 1024
+
+    def testSameFrags(self):
+        expected = _fragDicts(self.uncached(TEXT, self.style).frags)
+        for i in (0,1,2):
+            self.assertEquals(_fragDicts(Paragraph(TEXT, self.style).frags), expected)
+
+    def testCopies(self):
+        """changing the frags a paragraph was given doesn't change the cached ones"""
+        expected = _fragDicts(self.uncached(TEXT, self.style).frags)
+        p = Paragraph(TEXT, self.style)
+        for f in p.frags:
+            f.text = 'changed'
+            f.fontName = 'Courier'
+            if hasattr(f,'cbDefn'): f.cbDefn.width = 999
+        del p.frags[1:]
+        self.assertEquals(_fragDicts(Paragraph(TEXT, self.style).frags), expected)
+
+    def testTextTransform(self):
+        """textTransform changes the paragraph's copy of the frags, not the cached ones"""
+        self.style.textTransform = 'uppercase'
+        text = 'some lower case words'
+        for i in (0,1):
+            self.assertEquals(Paragraph(text, self.style).frags[0].text, 'SOME LOWER CASE WORDS')
+        cached = [e[3][0].text for k, e in paragraph._fragCache.items() if k[1]==text]
+        self.assertEquals(cached, [text])
+
+    def testStyleChange(self):
+        """a style whose attributes change isn't given frags parsed with the old ones"""
+        Paragraph(TEXT, self.style)
+        self.style.fontName = 'Courier'
+        self.style.fontSize = 17
+        for f in Paragraph(TEXT, self.style).frags:
+            self.assertEquals((f.fontSize, f.fontName[:7]), (17, 'Courier'))
+
+    def testSeq(self):
+        """each <seq/> counts on, so markup with one is always reparsed"""
+        text = '<seq id="cachetest"/>. item'
+        texts = [Paragraph(text, self.style).frags[0].text for i in (0,1,2)]
+        self.assertEquals(texts, ['1', '2', '3'])
+
+def _lines(blPara):
+    "the text of each line of blPara"
+    if blPara.kind==0:
+        return [' '.join(line[1]) for line in blPara.lines]
+    return [''.join([getattr(f,'text','') for f in line.words]) for line in blPara.lines]
+
+def _extraSpaces(blPara):
+    "the space left at the end of each line of blPara with the number of words on it"
+    if blPara.kind==0:
+        return [(line[0], len(line[1])) for line in blPara.lines]
+    return [(line.extraSpace, len(' '.join([getattr(f,'text','') for f in line.words]).split())) for line in blPara.lines]
+
+class WrapMemoTestCase(unittest.TestCase):
+    texts = [' '.join(['word%d' % (i*7%13) for i in xrange(60)]),
+        'some <b>bold</b> and <i>italic</i> words '*6 + '<br/>after a break '*3]
+
+    def setUp(self):
+        self.style = deepcopy(getSampleStyleSheet()['BodyText'])
+        self.style.alignment = TA_JUSTIFY
+
+    def fresh(self, text, width, height=1e6):
+        p = Paragraph(text, self.style)
+        size = p.wrap(width, height)
+        return size, _lines(p.blPara)
+
+    def check(self, p, text, width):
+        size = p.wrap(width, 1e6)
+        self.assertEquals((size, _lines(p.blPara)), self.fresh(text, width))
+
+    def testWidths(self):
+        for text in self.texts:
+            p = Paragraph(text, self.style)
+            for width in (100, 250, 100, 180, 250, 100):
+                self.check(p, text, width)
+
+    def testSplit(self):
+        """splitting changes the words of blPara's lines, so they aren't remembered"""
+        for text in self.texts:
+            p = Paragraph(text, self.style)
+            p.wrap(150, 1e6)
+            S = p.split(150, 40)
+            self.assertEquals(len(S), 2)
+            for width in (150, 200, 150):
+                self.check(p, text, width)
+            lines = []
+            for s in S:
+                s.wrap(150, 1e6)
+                lines.extend([l.split() for l in _lines(s.blPara)])
+            self.assertEquals(lines, [l.split() for l in self.fresh(text, 150)[1]])
+
+    def testDraw(self):
+        canv = Canvas(StringIO())
+        for text in self.texts:
+            p = Paragraph(text, self.style)
+            for width in (120, 220, 120):
+                p.wrap(width, 1e6)
+                p.drawOn(canv, 0, 0)
+                self.check(p, text, width)
+
+    def testChanges(self):
+        """changing the style or replacing the frags invalidates the memo"""
+        p = Paragraph(self.texts[0], self.style)
+        p.wrap(150, 1e6)
+        self.style.alignment = 0
+        self.style.leading = 17
+        size = p.wrap(150, 1e6)
+        fresh = Paragraph(None, self.style, frags=p.frags)
+        self.assertEquals((size, _lines(p.blPara)), (fresh.wrap(150, 1e6), _lines(fresh.blPara)))
+        other = Paragraph(self.texts[1], self.style)
+        p.frags = other.frags
+        p.wrap(150, 1e6)
+        self.assertEquals(_lines(p.blPara), self.fresh(self.texts[1], 150)[1])
+
+def _randomText(r, n, markup):
+    words = []
+    for i in xrange(n):
+        word = ''.join([r.choice('abcdefghijklmnopqrstuvwxyz') for j in xrange(r.choice((1,2,3,4,5,6,8,12)))])
+        if markup:
+            x = r.random()
+            if x<0.1: word = '<b>%s</b>' % word
+            elif x<0.15: word = '<i>%s</i>' % word
+            elif x<0.17: word += '<br/>'
+        words.append(word)
+    return ' '.join(words)
+
+def _words(p):
+    if p.blPara.kind==0:
+        return ' '.join(_lines(p.blPara)).split()
+    return ' '.join([getattr(f,'text','') for line in p.blPara.lines for f in line.words]).split()
+
+class TotalFitTestCase(unittest.TestCase):
+    def setUp(self):
+        self.style = deepcopy(getSampleStyleSheet()['BodyText'])
+        self.style.fontName = 'Times-Roman'
+        self.style.fontSize = 7
+        self.style.leading = 8.5
+
+    def wrapBoth(self, text, width, **kw):
+        R = []
+        for wordWrap in (None,'TOTALFIT'):
+            style = deepcopy(self.style)
+            style.wordWrap = wordWrap
+            p = Paragraph(text, style, **kw)
+            R.append((p.wrap(width, 1e6)[1], len(p.blPara.lines), _words(p), _extraSpaces(p.blPara)))
+        return R
+
+    def overflows(self, extraSpaces, squeeze=0):
+        "whether any line with more than one word on it is too long, allowing its spaces to shrink by squeeze"
+        spaceWidth = 0.25*self.style.fontSize
+        for extraSpace, n in extraSpaces:
+            if n>1 and extraSpace < -(n-1)*spaceWidth*squeeze - 1e-6:
+                return 1
+        return 0
+
+    def compare(self, greedy, totalFit, text):
+        self.assertEquals(totalFit[2], greedy[2])
+        justified = self.style.alignment==TA_JUSTIFY
+        self.failIf(self.overflows(totalFit[3], justified and paragraph._tfShrink), 'overflow in %r' % text)
+        # greedy lets a line overflow when it starts with an empty frag, e.g. after <br/> <b>
+        if not self.overflows(greedy[3]):
+            self.assert_(totalFit[0]<=greedy[0], 'taller: %r' % text)
+            if not justified:
+                # without squeezed spaces greedy is already as short as it gets
+                self.assertEquals(totalFit[1], greedy[1])
+
+    def testNeverTaller(self):
+        """total fit keeps every word in order, never overflows and never needs more height than greedy breaking"""
+        r = random.Random(17)
+        for alignment in (TA_JUSTIFY, 0):
+            self.style.alignment = alignment
+            for markup in (0,1):
+                for i in xrange(40):
+                    text = _randomText(r, r.randint(1,80), markup)
+                    self.style.firstLineIndent = r.choice((0,0,12,-6))
+                    for width in (40, 90, 150, 300):
+                        greedy, totalFit = self.wrapBoth(text, width)
+                        self.compare(greedy, totalFit, text)
+
+    def testBullet(self):
+        r = random.Random(3)
+        self.style.leftIndent = 18
+        self.style.bulletIndent = 0
+        for i in xrange(20):
+            text = _randomText(r, 50, i%2)
+            greedy, totalFit = self.wrapBoth(text, 150, bulletText=u'\u2022')
+            self.compare(greedy, totalFit, text)
+
+    def testPreformatted(self):
+        """preformatted text keeps its own lines"""
+        text = 'one line\n  and another   with spaces\n\nand a last one'
+        R = []
+        for wordWrap in (None,'TOTALFIT'):
+            style = deepcopy(self.style)
+            style.wordWrap = wordWrap
+            p = XPreformatted(text, style)
+            R.append((p.wrap(200, 1e6), _lines(p.blPara)))
+        self.assertEquals(R[0], R[1])
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+"""Tests that reportlab.platypus.paraparser gives the same results with expat as with xmllib"""
+import unittest
+
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import paraparser
+from reportlab.platypus.paragraph import cleanBlockQuotedText
+
+TEXTS = [
+    'plain text',
+    u'unicode text \xe9\u2022 with a <b>bold</b> word',
+    '<b>@someone</b> a tweet &amp; a <a href="http://x.com/a?b=1&amp;c=2" color="blue">link</a>',
+    'A&lt;B&gt;C&amp;D&quot;E&apos;F and A&lt; B&gt; C&amp; D&quot; E&apos; F',
+    'char refs &#233;&#x2022; &#65;&#32;B and &beta;&alpha; greek entities',
+    'unknown &nbsp; entity and &bogus; ones',
+    '<i>italic <b>bold italic <u>underlined</u></b></i> <strike>struck</strike>',
+    'x<super>2</super> + y<sub>i</sub> = <font name="Courier" size="14" color="red">z</font>',
+    '<FONT FACE="Helvetica" SIZE="14pt">Helvetica 14</FONT> with <STRONG>strong</STRONG> <EM>emphasis</EM>',
+    'Before the break <br/>the middle line <br/> and the last line.',
+    '<greek>abc</greek> <unichar name="BULLET"/> <unichar value="0x394"/>',
+    '<img src="http://example.com/a.png" width="10" height="12" valign="middle"/> image',
+    '<a name="anchor"/>named <link href="#anchor">link</link> <a href="x" color="#ff0000">a</a>',
+    '<para alignment="center" fontSize="12" leading="14">para attributes</para>',
+    '<bullet>&bull;</bullet>bulleted',
+    '<onDraw name="myFunc" label="aaa bbb">drawn',
+    'unquoted <font size=15 color=green>attributes</font>',
+    'attribute <font color="&#x23;ff0000">reference</font> and <a href="a&nbsp;b">entity</a>',
+    'comment <!-- here --> and <![CDATA[<>&]]> cdata',
+    'malformed <b>nesting <i>here</b></i>',
+    'bare & ampersand and < bracket',
+    '<unknowntag>unknown</unknowntag> tag',
+    'ends with > and ]]&gt; symbols > ok',
+    ]
+
+def _fragDict(frag):
+    D = frag.__dict__.copy()
+    if 'cbDefn' in D: D['cbDefn'] = D['cbDefn'].__dict__.copy()
+    return D
+
+def _parse(text, style, useExpat, caseSensitive):
+    "the style, frags, bullet frags and errors from parsing text, or the exception raised"
+    p = paraparser.ParaParser()
+    p.caseSensitive = caseSensitive
+    p.useExpat = useExpat
+    try:
+        r = p.parse(text,style)
+    except Exception, e:
+        return e.__class__
+    S = r[0].__dict__.copy()
+    S.pop('parent',None)    # a deepcopy when the <para> tag has attributes
+    return S, r[1] and map(_fragDict,r[1]), r[2] and map(_fragDict,r[2]), p.errors
+
+class ExpatParityTestCase(unittest.TestCase):
+    def setUp(self):
+        self.style = getSampleStyleSheet()['BodyText']
+
+    def check(self, text):
+        text = cleanBlockQuotedText(text)
+        for caseSensitive in (0,1):
+            self.assertEquals(_parse(text,self.style,1,caseSensitive), _parse(text,self.style,0,caseSensitive),
+                'expat and xmllib differ on %r (caseSensitive=%d)' % (text,caseSensitive))
+
+    def testParity(self):
+        for text in TEXTS:
+            self.check(text)
+
+    def testRepeatedParser(self):
+        """a parser reused across texts gives what a fresh one would"""
+        p = paraparser.ParaParser()
+        p.useExpat = 1
+        for text in TEXTS:
+            text = cleanBlockQuotedText(text)
+            r = p.parse(text,self.style)
+            self.assertEquals(r[1] and map(_fragDict,r[1]), _parse(text,self.style,1,0)[1])
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+"""Tests for row sizing and the cell geometry cache in reportlab.platypus.tables"""
+import unittest
+from cStringIO import StringIO
+
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus.doctemplate import SimpleDocTemplate
+from reportlab.platypus.paragraph import Paragraph
+from reportlab.platypus.tables import Table
+
+def _table(n, longTable, spans=0):
+    style = getSampleStyleSheet()['BodyText']
+    data = []
+    for i in xrange(n):
+        text = 'Row <b>%d</b> of the table' % i + ' with a longer cell'*(i%4)
+        data.append(['%d' % i, Paragraph(text, style), 'x\n'*(i%3)])
+    rowHeights = [i%7==0 and 30 or None for i in xrange(n)]
+    cmds = spans and [('SPAN',(2,i),(2,i+1)) for i in xrange(1,n-1,5)] or []
+    t = Table(data, colWidths=(40,200,40), rowHeights=rowHeights, style=cmds)
+    t._longTableOptimize = longTable
+    return t
+
+class RowHeightTestCase(unittest.TestCase):
+    def testRowHeights(self):
+        for spans in (0,1):
+            heights = []
+            for longTable in (0,1):
+                t = _table(200, longTable, spans)
+                t.wrap(280, 1e9)
+                heights.append(t._rowHeights)
+            self.assertEquals(heights[0], heights[1])
+            self.assert_(None not in heights[0])
+
+    def testSplit(self):
+        """long tables size only the rows that can fit, but split in the same place"""
+        # without spans: long tables can't cope with one crossing where they stop sizing
+        for availHeight in (50, 333, 1000, 5000):
+            parts = []
+            for longTable in (0,1):
+                t = _table(200, longTable)
+                t.wrap(280, availHeight)
+                S = t.split(280, availHeight)
+                parts.append([len(s._cellvalues) for s in S])
+                self.assertEquals(sum(parts[-1]), 200)
+            self.assertEquals(parts[0], parts[1])
+
+class _CountingParagraph(Paragraph):
+    def wrap(self, availWidth, availHeight):
+        self.wraps[availWidth] = self.wraps.get(availWidth,0)+1
+        return Paragraph.wrap(self, availWidth, availHeight)
+
+def _flowableTable(n, cls=Paragraph, colWidths=(60,None,'30%')):
+    style = getSampleStyleSheet()['BodyText']
+    data = []
+    for i in xrange(n):
+        cell = [cls('Cell <i>%d</i>' % i + ' and some more words'*(i%5), style), cls('second %d' % i, style)]
+        data.append(['%d' % i, cell, cls('x '*(i%9), style)])
+    return Table(data, colWidths=colWidths, repeatRows=1)
+
+class CellGeomCacheTestCase(unittest.TestCase):
+    def _build(self, n):
+        out = StringIO()
+        SimpleDocTemplate(out, invariant=1).build([_flowableTable(n)])
+        return out.getvalue()
+
+    def testSameOutput(self):
+        """a long table of flowable cells comes out the same without the cache"""
+        cached = self._build(150)
+        wrapCell = Table._wrapCell
+        try:
+            Table._wrapCell = lambda self, v, canv, aW, aH, sizeOnly=0: v.wrapOn(canv, aW, aH)
+            uncached = self._build(150)
+        finally:
+            Table._wrapCell = wrapCell
+        self.assertEquals(cached, uncached)
+
+    def testSizedOnce(self):
+        """wrapping and splitting size each cell flowable once for each width"""
+        _CountingParagraph.wraps = {}
+        t = _flowableTable(60, _CountingParagraph, colWidths=(60,None,None))
+        cells = [v for row in t._cellvalues for c in row for v in (isinstance(c,list) and c or [c]) if isinstance(v,Paragraph)]
+        for v in cells: v.wraps = {}
+        t.wrap(400, 500)
+        S = t.split(400, 500)
+        for s in S: s.wrap(400, 5000)
+        for v in cells:
+            self.assertEquals([k for k, n in v.wraps.items() if n>1], [])
+
+    def testWidths(self):
+        """sizes remembered at one width aren't used at another"""
+        style = getSampleStyleSheet()['BodyText']
+        text = 'a paragraph long enough to need more lines in a narrow cell than a wide one'
+        t = _flowableTable(1)
+        p = Paragraph(text, style)
+        narrow = t._wrapCell(p, None, 100, 1e9, sizeOnly=1)
+        wide = t._wrapCell(p, None, 300, 1e9, sizeOnly=1)
+        self.assertNotEquals(narrow[1], wide[1])
+        self.assertEquals(wide, Paragraph(text, style).wrap(300, 1e9))
+        self.assertEquals(t._wrapCell(p, None, 100, 1e9, sizeOnly=1), narrow)
+
+if __name__=='__main__':
+    unittest.main()
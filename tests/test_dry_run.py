@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_dry_run.py
+Check that a dry run lays out the booklet without touching the network
+"""
+
+import sitecustomize
+
+# Builtin modules
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+import cPickle as pickle
+
+import digest
+from digestcache import http_cache
+from digestrecord import Session
+
+class DryRunTest(unittest.TestCase):
+    """Run dry_run with socket creation and name lookups recorded and refused"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.opened = []
+        self.saved = (socket.socket, socket.getaddrinfo,
+            http_cache.path, http_cache.offline, http_cache.enabled)
+        def refuse(*args, **kwargs):
+            self.opened.append(args)
+            raise socket.error("the dry run tried to use the network")
+        socket.socket = refuse
+        socket.getaddrinfo = refuse
+        # Start from an empty cache so every source has to go without
+        http_cache.path = os.path.join(self.tmp, "http")
+
+    def tearDown(self):
+        (socket.socket, socket.getaddrinfo,
+            http_cache.path, http_cache.offline, http_cache.enabled) = self.saved
+        shutil.rmtree(self.tmp)
+
+    def test_empty_cache(self):
+        digest.dry_run()
+        self.assertEquals(self.opened, [])
+
+    def test_empty_recording(self):
+        # As digest.py --dry-run --replay does it
+        recording = os.path.join(self.tmp, "recording")
+        f = open(recording, 'wb')
+        try:
+            pickle.dump([], f, pickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+        http_cache.enabled = False
+        session = Session(recording, 'replay')
+        session.start()
+        try:
+            digest.dry_run()
+        finally:
+            session.stop()
+        self.assertEquals(self.opened, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+a85.py
+Time reportlab's ASCII85 and hex codecs on random data
+"""
+
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lib'))
+
+import time
+import random
+from optparse import OptionParser
+
+from reportlab.pdfbase import pdfutils
+
+def benchmark(size=4*1024*1024, repeats=1):
+    """Time each ASCII85 codec and the hex codec on size bytes, half random and half zeros"""
+    data = ''.join([chr(random.randint(0, 255)) for i in xrange(size//2)]) + '\000'*(size - size//2)
+    codecs = [
+        ('PYTHON', pdfutils._AsciiBase85EncodePYTHON, pdfutils._AsciiBase85DecodePYTHON),
+        ('STRUCT', pdfutils._AsciiBase85EncodeSTRUCT, pdfutils._AsciiBase85DecodeSTRUCT),
+    ]
+    if pdfutils.numpy:
+        codecs.append(('NUMPY', pdfutils._AsciiBase85EncodeNUMPY, pdfutils._AsciiBase85DecodeNUMPY))
+    if pdfutils._AsciiBase85Encode not in [c[1] for c in codecs]:
+        codecs.append(('_rl_accel', pdfutils._AsciiBase85Encode, pdfutils._AsciiBase85Decode))
+    for name, encode, decode in codecs:
+        started = time.time()
+        for i in xrange(repeats):
+            encoded = encode(data)
+        encoded_at = time.time()
+        for i in xrange(repeats):
+            decode(encoded)
+        print '%-10s %d bytes: encode %.3fs decode %.3fs' % (
+            name, size, (encoded_at - started)/repeats, (time.time() - encoded_at)/repeats)
+    started = time.time()
+    for i in xrange(repeats):
+        pdfutils._AsciiHexDecode(pdfutils._AsciiHexEncode(data))
+    print '%-10s %d bytes: round trip %.3fs' % ('hex', size, (time.time() - started)/repeats)
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("--size", type="int", default=4*1024*1024,
+        help="bytes of data to encode")
+    parser.add_option("--repeats", type="int", default=1,
+        help="times to run each codec")
+    options, args = parser.parse_args()
+    benchmark(options.size, options.repeats)
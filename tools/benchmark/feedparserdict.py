@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+feedparserdict.py
+Time parsing a long RSS feed with feedparser and reading its entries back
+"""
+
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lib'))
+
+import time
+from optparse import OptionParser
+
+import feedparser
+
+def benchmark(entries=1000):
+    """Parse an RSS 2.0 feed with this many entries, then read each one back through FeedParserDict"""
+    items = ['<item><title>Headline %d &amp; more</title><link>http://example.com/%d</link>'
+        '<guid>http://example.com/%d</guid><description>&lt;p&gt;Story %d&lt;/p&gt;</description>'
+        '<pubDate>Mon, 01 Jan 2007 %02d:%02d:00 GMT</pubDate><category>news</category></item>'
+        % (i, i, i, i, i / 60 % 24, i % 60) for i in xrange(entries)]
+    data = ('<?xml version="1.0"?><rss version="2.0"><channel><title>Benchmark</title>'
+        '<link>http://example.com/</link><description>Feed</description>%s</channel></rss>' % ''.join(items))
+    started = time.time()
+    result = feedparser.parse(data)
+    print '%d entries parsed in %0.3f seconds' % (len(result.entries), time.time() - started)
+    started = time.time()
+    for i in xrange(10):
+        for entry in result.entries:
+            entry.title, entry.updated, entry.date, entry.get('category'), entry.has_key('description')
+    print '%d entries read 10 times in %0.3f seconds' % (len(result.entries), time.time() - started)
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("--entries", type="int", default=1000,
+        help="how many entries the feed has")
+    options, args = parser.parse_args()
+    benchmark(options.entries)
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+longtable.py
+Time wrapping reportlab tables of increasing length
+"""
+
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lib'))
+
+import time
+from optparse import OptionParser
+
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus.paragraph import Paragraph
+from reportlab.platypus.tables import Table
+
+def benchmark(sizes=(500, 1000, 2000, 4000)):
+    """Wrap tables of each size with and without longTableOptimize; time per row should stay flat"""
+    style = getSampleStyleSheet()['BodyText']
+    for longTable in (0, 1):
+        for n in sizes:
+            data = [['%d' % i, Paragraph('Row <b>%d</b> of the table' % i, style), 'x'] for i in xrange(n)]
+            table = Table(data, colWidths=(40, 200, 40))
+            table._longTableOptimize = longTable
+            started = time.time()
+            table.wrap(280, 1e9)
+            taken = time.time() - started
+            print 'longTableOptimize=%d %5d rows: %0.3f seconds (%0.1f us/row)' % (
+                longTable, n, taken, 1e6*taken/n)
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="%prog [rows ...]")
+    options, args = parser.parse_args()
+    if args:
+        benchmark([int(n) for n in args])
+    else:
+        benchmark()
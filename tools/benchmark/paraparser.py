@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+paraparser.py
+Time reportlab's paragraph markup parser with xmllib and with expat
+"""
+
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lib'))
+
+import time
+from optparse import OptionParser
+
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import paraparser
+
+def benchmark(n=3000):
+    """Time parsing n short paragraphs of the kind the digest builds"""
+    style = getSampleStyleSheet()['BodyText']
+    texts = ['<b>@user%d</b> a tweet &amp; a <a href="http://x.com/%d?a=1&amp;b=2" color="blue">link</a> and <i>some</i> text' % (i, i)
+        for i in xrange(n)]
+    parser = paraparser.ParaParser()
+    for useExpat in (0, 1):
+        if useExpat and paraparser.expat is None:
+            break
+        parser.useExpat = useExpat
+        started = time.time()
+        for text in texts:
+            parser.parse(text, style)
+        print '%s: %d paragraphs parsed in %0.3f seconds' % (
+            useExpat and 'expat' or 'xmllib', n, time.time() - started)
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("-n", type="int", default=3000,
+        help="how many paragraphs to parse")
+    options, args = parser.parse_args()
+    benchmark(options.n)
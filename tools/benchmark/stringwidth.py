@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+stringwidth.py
+Time a long paragraph story with and without reportlab's stringWidth memo
+"""
+
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lib'))
+
+import time
+from cStringIO import StringIO
+from optparse import OptionParser
+
+from reportlab import rl_config
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.pdfbase.pdfmetrics import Font
+from reportlab.platypus import SimpleDocTemplate, Paragraph
+
+WORDS = """Upcoming events at the Union Chapel, Islington with
+    The Wombats, Los Campesinos! and Johnny Foreigner; <b>tube status</b>
+    for the Victoria, Central and <i>Hammersmith &amp; City</i> lines; feed
+    headlines from BBC News, The Guardian and Ars Technica""".split()
+
+def build(pages):
+    """Build a story of about pages pages and return how long it took"""
+    style = getSampleStyleSheet()['BodyText']
+    story = []
+    for i in xrange(pages*12):
+        n = i % len(WORDS)
+        story.append(Paragraph(" ".join(WORDS[n:] + WORDS[:n]), style))
+    started = time.time()
+    SimpleDocTemplate(StringIO()).build(story)
+    return time.time() - started
+
+def benchmark(pages=50):
+    """Build the story with unicode2T1 widths, the width vector alone, and the vector and memo"""
+    size = rl_config.stringWidthCacheSize
+    try:
+        rl_config.stringWidthCacheSize = 0
+        Font.stringWidth = Font._py_stringWidth
+        print 'unicode2T1 stringWidth: %0.3f seconds' % build(pages)
+        Font.stringWidth = Font._memoStringWidth
+        print 'width vector, no memo:  %0.3f seconds' % build(pages)
+        rl_config.stringWidthCacheSize = size
+        print 'width vector and memo:  %0.3f seconds' % build(pages)
+    finally:
+        rl_config.stringWidthCacheSize = size
+        Font.stringWidth = Font._memoStringWidth
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("--pages", type="int", default=50,
+        help="roughly how many pages the story runs to")
+    options, args = parser.parse_args()
+    benchmark(options.pages)